@@ -1,4 +1,4 @@
-import random
+import base64
 import numpy
 from threading import Lock
 from seabreeze.spectrometers import list_devices, Spectrometer
@@ -10,6 +10,10 @@ import dash_bootstrap_components as dbc
 import plotly.graph_objs as go
 import dash_daq as daq
 from dash.dependencies import Input, Output, State
+from acquisition import SpectrumRingBuffer, AcquisitionThread, SpectrumAverager
+from display import decimate_axis, decimate_minmax, value_range
+from correction import ReferenceSpectra, average_spectra
+from processing import AbsorbanceHistory
 
 # abstract base class to represent spectrometers
 class DashOceanOpticsSpectrometer:
@@ -17,7 +21,8 @@ class DashOceanOpticsSpectrometer:
         self._spec = None                 # spectrometer
         self._specmodel = ''              # model name for graph title
         self._spectralData = [[], []]     # wavelengths and intensities
-        self._controlFunctions = {}       # behaviour upon changing controls
+        self._controlFunctions = {}       # ctrl_id -> ControlFunction
+        self._controlValues = {}          # last value applied per control
         self._int_time_max = 1    # maximum integration time (ms)
         self._int_time_min = 0         # minimum integration time (ms)
         self.comm_lock = commLock         # for communicating with spectrometer
@@ -35,6 +40,38 @@ class DashOceanOpticsSpectrometer:
     def send_control_values(self, commands):
         return ({}, {})
 
+    # applies a batch of commands through the control registry, holding lock
+    # (if given) once for the whole batch; a value that is already set is
+    # skipped without touching the device
+    def apply_controls(self, commands, lock=None):
+        failed = {}
+        succeeded = {}
+
+        if lock is not None:
+            lock.acquire()
+        try:
+            for ctrl_id in commands:
+                try:
+                    control = self._controlFunctions.get(ctrl_id)
+                    if control is None:
+                        raise ValueError('control not available')
+                    value = control.validate(commands[ctrl_id])
+                    if ctrl_id not in self._controlValues or \
+                       self._controlValues[ctrl_id] != value:
+                        control.apply(value)
+                        self._controlValues[ctrl_id] = value
+                    succeeded[ctrl_id] = str(commands[ctrl_id])
+                except Exception as e:
+                    failed[ctrl_id] = self.control_error(e)
+        finally:
+            if lock is not None:
+                lock.release()
+
+        return(failed, succeeded)
+
+    def control_error(self, e):
+        return str(e)
+
     # getter methods
     def model(self):
         return self._specmodel
@@ -45,33 +82,104 @@ class DashOceanOpticsSpectrometer:
     def int_time_min(self):
         return self._int_time_min
 
+# behaviour upon changing a control: a callable that applies the value to the
+# device, bound once when the device is connected, and a validator that
+# converts and checks the value first
+class ControlFunction:
+    def __init__(self, apply, validate=None):
+        self.apply = apply
+        self._validate = validate
+
+    def validate(self, value):
+        if self._validate is None:
+            return value
+        return self._validate(value)
+
+# properties of a connected spectrometer that don't change while it stays
+# connected; read once at connect time so the getters don't touch USB
+class SpectrometerDescriptor:
+    def __init__(self, serial_number, model, int_time_min, int_time_max):
+        self.serial_number = serial_number
+        self.model = model
+        self.int_time_min = int_time_min    # minimum integration time (μs)
+        self.int_time_max = int_time_max    # maximum integration time (μs)
+
+    @classmethod
+    def from_device(cls, device):
+        limits = device.integration_time_micros_limits
+        return cls(device.serial_number, device.model, limits[0], limits[1])
+
 # non-demo version
 class PhysicalSpectrometer(DashOceanOpticsSpectrometer):
 
-    def __init__(self, specLock, commLock):
+    def __init__(self, specLock, commLock, serial_number=None, device=None):
         super().__init__(specLock, commLock)
+        self._serial_number = serial_number   # None for the first found
+        self._device = device             # already enumerated, if given
+        self._averager = None             # SpectrumAverager for _spec
+        self._descriptor = None           # cached SpectrometerDescriptor
         self.spec_lock.acquire()
         self.assign_spec()
         self.spec_lock.release()
-        self._controlFunctions = {
-            'integration-time-input':
-            "self._spec.integration_time_micros",
-        }
 
+    # connects to the spectrometer with our serial number (or the first one
+    # found), unless one is already connected; the USB bus is only
+    # enumerated when nothing is cached
     def assign_spec(self):
+        if self._descriptor is not None:
+            return
         try:
             self.comm_lock.acquire()
-            devices = list_devices()
+            if self._device is not None:
+                devices = [self._device]
+                self._device = None
+            else:
+                devices = list_devices()
+            if self._serial_number is not None:
+                devices = [d for d in devices
+                           if d.serial_number == self._serial_number]
             self._spec = Spectrometer(devices[0])
-            self._specmodel = self._spec.model
-            self._int_time_min = self._spec.integration_time_micros_limits[0]
-            self._int_time_max = self._spec.integration_time_micros_limits[1]
+            self._descriptor = SpectrometerDescriptor.from_device(self._spec)
+            self._specmodel = self._descriptor.model
+            self._int_time_min = self._descriptor.int_time_min
+            self._int_time_max = self._descriptor.int_time_max
+            self._averager = SpectrumAverager(self._spec)
+            self._controlFunctions = {
+                'integration-time-input':
+                ControlFunction(self._spec.integration_time_micros,
+                                self.validate_int_time),
+                'scans-to-average-input':
+                ControlFunction(self._averager.set_scans_to_average, int),
+                'boxcar-width-input':
+                ControlFunction(self._averager.set_boxcar_width, int),
+            }
+            self._controlValues = {}
         except Exception:
-            pass
+            self._spec = None
+            self._descriptor = None
+            self._averager = None
+            self._controlFunctions = {}
         finally:
             self.comm_lock.release()
             print('Spectrometer '+str(self._specmodel)+' connected with integration limits '+str(int(self._int_time_min))+' to '+str(int(self._int_time_max)))
 
+    # closes the device and forgets the cached descriptor, so that the next
+    # call to assign_spec enumerates the bus again
+    def disconnect(self):
+        try:
+            self.comm_lock.acquire()
+            if self._spec is not None:
+                self._spec.close()
+        except Exception:
+            pass
+        finally:
+            self._spec = None
+            self._descriptor = None
+            self._averager = None
+            self._controlFunctions = {}
+            self._controlValues = {}
+            self.comm_lock.release()
+
     def get_spectrum(self):
         if self._spec is None:
             try:
@@ -81,33 +189,45 @@ class PhysicalSpectrometer(DashOceanOpticsSpectrometer):
                 pass
             finally:
                 self.spec_lock.release()
+        failed = False
         try:
             self.comm_lock.acquire()
-            self._spectralData = self._spec.spectrum(correct_dark_counts=False,
-                                                     correct_nonlinearity=True)
+            self._spectralData = self._averager.spectrum(
+                correct_dark_counts=False, correct_nonlinearity=True)
         except Exception:
-            pass
+            failed = True
         finally:
             self.comm_lock.release()
 
+        # device probably went away; reconnect on the next call
+        if failed:
+            self.disconnect()
+
         return self._spectralData
 
     def send_control_values(self, commands):
-        failed = {}
-        succeeded = {}
-
-        for ctrl_id in commands:
+        if self._spec is None:
             try:
-                self.comm_lock.acquire()
-                eval(self._controlFunctions[ctrl_id])(commands[ctrl_id])
-                succeeded[ctrl_id] = str(commands[ctrl_id])
-            except Exception as e:
-                failed[ctrl_id] = str(e).strip('b')
+                self.spec_lock.acquire()
+                self.assign_spec()
+            except Exception:
+                pass
             finally:
-                self.comm_lock.release()
+                self.spec_lock.release()
+        return self.apply_controls(commands, self.comm_lock)
 
-        return(failed, succeeded)
+    def control_error(self, e):
+        return str(e).strip('b')
+
+    def validate_int_time(self, value):
+        value = int(value)
+        if not self._int_time_min <= value <= self._int_time_max:
+            raise ValueError('must be between %d and %d'
+                             % (self._int_time_min, self._int_time_max))
+        return value
 
+    # getters read the cached descriptor; assign_spec is a no-op unless the
+    # spectrometer has not been connected yet or was disconnected
     def model(self):
         self.spec_lock.acquire()
         self.assign_spec()
@@ -128,7 +248,7 @@ class PhysicalSpectrometer(DashOceanOpticsSpectrometer):
 
 class DemoSpectrometer(DashOceanOpticsSpectrometer):
 
-    def __init__(self, specLock, commLock):
+    def __init__(self, specLock, commLock, seed=None):
         super().__init__(specLock, commLock)
         try:
             self.spec_lock.acquire()
@@ -137,34 +257,34 @@ class DemoSpectrometer(DashOceanOpticsSpectrometer):
             pass
         finally:
             self.spec_lock.release()
-        self.controlFunctions = {
+        self._controlFunctions = {
             'integration-time-input':
-            "self.integration_time_demo",
+            ControlFunction(self.integration_time_demo, float),
+            'scans-to-average-input':
+            ControlFunction(self.scans_to_average_demo, int),
+            'boxcar-width-input':
+            ControlFunction(self.empty_control_demo, int),
         }
+        self._sample_noise = 0.01
         self._sample_data_scale = self._int_time_min
+        self._demo_period = 0.05          # shortest time per spectrum (s)
         self._sample_data_add = 0
+        self._rng = numpy.random.default_rng(seed)  # same seed, same spectra
+        self._demo_wavelengths = numpy.linspace(400, 900, 5000)
 
     def assign_spec(self):
         self._specmodel = "USB2000+"
 
+    # takes as long as the integration time (in μs), or the demo period if
+    # that is longer, like a real spectrometer
     def get_spectrum(self, int_time_demo_val=1000):
-        self._spectralData[0] = numpy.linspace(400, 900, 5000)
-        self._spectralData[1] = [self.sample_spectrum(wl)
-                                 for wl in self._spectralData[0]]
+        time.sleep(max(self._demo_period, self._sample_data_scale / 1e6))
+        self._spectralData = [self._demo_wavelengths,
+                              self.sample_spectrum(self._demo_wavelengths)]
         return self._spectralData
 
     def send_control_values(self, commands):
-        failed = {}
-        succeeded = {}
-
-        for ctrl_id in commands:
-            try:
-                eval(self.controlFunctions[ctrl_id])(commands[ctrl_id])
-                succeeded[ctrl_id] = str(commands[ctrl_id])
-            except Exception as e:
-                failed[ctrl_id] = str(e)
-
-        return(failed, succeeded)
+        return self.apply_controls(commands)
 
     def model(self):
         return self._specmodel
@@ -177,18 +297,172 @@ class DemoSpectrometer(DashOceanOpticsSpectrometer):
 
     # demo-specific methods
 
-    # generates a sample spectrum that's normally distributed about 500 nm
+    # generates a sample spectrum that's normally distributed about 500 nm;
+    # x is an array of wavelengths and the whole spectrum is drawn at once
     def sample_spectrum(self, x):
-        return (self._sample_data_scale * (numpy.e**(-1 * ((x-500) / 5)**2) +
-                                           0.01 * random.random()) +
+        x = numpy.asarray(x, dtype=numpy.float64)
+        noise = self._rng.random(x.shape)
+        return (self._sample_data_scale * (numpy.exp(-1 * ((x-500) / 5)**2) +
+                                           self._sample_noise * noise) +
                 self._sample_data_add * 10)
 
     def integration_time_demo(self, x):
         self._sample_data_scale = x
 
+    # averaging n scans reduces the noise by sqrt(n)
+    def scans_to_average_demo(self, n):
+        if n < 1:
+            raise ValueError('scans to average must be at least 1')
+        self._sample_noise = 0.01 / numpy.sqrt(n)
+
     def empty_control_demo(self, _):
         return
     
+# all spectrometers in use, keyed by serial number; each has its own locks,
+# ring buffer and acquisition thread, so they are read in parallel, and its
+# own dark and reference spectra. Spectrometers are only read while someone
+# is using them: resume keeps them going for keep_alive_seconds
+class SpectrometerPool:
+    def __init__(self, buffer_size=4, history_rows=600, history_columns=500,
+                 keep_alive_seconds=15):
+        self.buffer_size = buffer_size
+        self.keep_alive_seconds = keep_alive_seconds
+        self.history_rows = history_rows
+        self.history_columns = history_columns
+        self._specs = {}
+        self._buffers = {}
+        self._workers = {}
+        self._references = {}
+        self._histories = {}
+
+    def add(self, serial, spec):
+        self._specs[serial] = spec
+        self._buffers[serial] = SpectrumRingBuffer(size=self.buffer_size)
+        self._references[serial] = ReferenceSpectra()
+        self._histories[serial] = AbsorbanceHistory(self._references[serial],
+                                                    self.history_rows,
+                                                    self.history_columns)
+        self._workers[serial] = AcquisitionThread(
+            spec, self._buffers[serial], processor=self._histories[serial])
+
+    # adds every connected spectrometer that isn't in the pool yet
+    def discover(self):
+        try:
+            devices = list_devices()
+        except Exception:
+            devices = []
+        for device in devices:
+            serial = device.serial_number
+            if serial not in self._specs:
+                self.add(serial, PhysicalSpectrometer(Lock(), Lock(), serial,
+                                                      device))
+
+    # starts the acquisition threads (paused until resume)
+    def start(self):
+        for worker in self._workers.values():
+            if not worker.is_alive():
+                worker.start()
+
+    # reads every spectrometer for the next keep_alive_seconds
+    def resume(self):
+        for worker in self._workers.values():
+            worker.resume(self.keep_alive_seconds)
+
+    def pause(self):
+        for worker in self._workers.values():
+            worker.pause()
+
+    def serials(self):
+        return list(self._specs)
+
+    def spec(self, serial):
+        return self._specs[serial]
+
+    def buffer(self, serial):
+        return self._buffers[serial]
+
+    def references(self, serial):
+        return self._references[serial]
+
+    def history(self, serial):
+        return self._histories[serial]
+
+    def models(self):
+        return [spec.model() for spec in self._specs.values()]
+
+    # averages the next n_scans spectra of every spectrometer into its dark
+    # ('dark') or reference ('reference') spectrum; returns the serial
+    # numbers of the spectrometers that didn't deliver them within timeout
+    def capture(self, kind, n_scans=10, timeout_seconds=30):
+        self.resume()
+        failed = []
+        for serial, buffer in self._buffers.items():
+            last = [buffer.count()]
+
+            def read_spectrum():
+                # long captures mustn't outlast the keep-alive
+                self.resume()
+                frame = buffer.next_after(last[0], timeout_seconds)
+                if frame is None:
+                    raise TimeoutError()
+                last[0] = frame[0]
+                return frame[2], frame[3]
+
+            try:
+                wavelengths, intensities = average_spectra(read_spectrum,
+                                                           n_scans)
+            except TimeoutError:
+                failed.append(serial)
+                continue
+            references = self._references[serial]
+            if kind == 'dark':
+                references.set_dark(wavelengths, intensities)
+            else:
+                references.set_reference(wavelengths, intensities)
+        return failed
+
+    # a spectrum as shown in the live view: counts ('intensity'),
+    # transmission in % ('transmission') or absorbance ('absorbance'),
+    # corrected in place; None until the spectrometer has a reference
+    def view(self, serial, intensities, mode):
+        if mode == 'intensity':
+            return intensities
+        references = self._references[serial]
+        try:
+            if mode == 'transmission':
+                intensities = references.transmission(intensities,
+                                                       out=intensities)
+                intensities *= 100
+                return intensities
+            return references.absorbance(intensities, out=intensities)
+        except ValueError:
+            return None
+
+    # integration times every spectrometer in the pool accepts
+    def int_time_limits(self):
+        specs = list(self._specs.values())
+        return (max(spec.int_time_min() for spec in specs),
+                min(spec.int_time_max() for spec in specs))
+
+    # sends the commands to every spectrometer; failures are reported per
+    # control with the serial number of each spectrometer that failed
+    def send_control_values(self, commands):
+        failed = {}
+        succeeded = {}
+
+        for serial, spec in self._specs.items():
+            spec_failed, spec_succeeded = spec.send_control_values(commands)
+            for ctrl_id in spec_failed:
+                message = '%s: %s' % (serial, spec_failed[ctrl_id])
+                if ctrl_id in failed:
+                    message = failed[ctrl_id] + '; ' + message
+                failed[ctrl_id] = message
+            succeeded.update(spec_succeeded)
+
+        for ctrl_id in failed:
+            succeeded.pop(ctrl_id, None)
+        return(failed, succeeded)
+
 # class to represent all controls
 class Control:
     def __init__(self, new_ctrl_id, new_ctrl_name,
@@ -239,18 +513,47 @@ class Control:
 
 DEMO = False
 
+# live spectra are reduced to this many min/max buckets before being sent to
+# the browser; roughly the width of the graph in screen pixels
+DISPLAY_BUCKETS = 1000
+
+# spectra kept for the live absorbance heat map, and the wavelength buckets
+# each is averaged into
+HISTORY_ROWS = 600
+HISTORY_COLUMNS = 500
+
+# live view refresh period (ms): starting value and the range it adapts in
+REFRESH_MS = {'initial': 1000, 'min': 50, 'max': 5000}
+
+# spectrometers stop being read when no viewer has asked for a spectrum for
+# this long (s): a few of the longest refresh periods
+KEEP_ALIVE_SECONDS = 3 * REFRESH_MS['max'] / 1000
+
+# what the live view can show, with the title of its intensity axis
+VIEW_TITLES = {
+    'intensity': 'Intensity (A.U.)',
+    'transmission': 'Transmission (%)',
+    'absorbance': 'Absorbance'
+}
+
 #############################
 # Spectrometer properties
 #############################
 
-# lock for modifying information about spectrometer
-spec_lock = Lock()
-# lock for communicating with spectrometer
-comm_lock = Lock()
-
-# initialize spec
-spec = PhysicalSpectrometer(spec_lock, comm_lock)
-spec.assign_spec()
+# every spectrometer has its own locks for modifying information about it
+# and for communicating with it, and is read in the background; callbacks
+# only look at the latest spectrum of each
+spectrometers = SpectrometerPool(buffer_size=4, history_rows=HISTORY_ROWS,
+                                 history_columns=HISTORY_COLUMNS,
+                                 keep_alive_seconds=KEEP_ALIVE_SECONDS)
+if DEMO:
+    spectrometers.add('demo', DemoSpectrometer(Lock(), Lock()))
+else:
+    spectrometers.discover()
+    # nothing connected yet: keep trying whichever spectrometer turns up
+    if not spectrometers.serials():
+        spectrometers.add('default', PhysicalSpectrometer(Lock(), Lock()))
+spectrometers.start()
 
 ############################
 # Begin Dash app
@@ -276,18 +579,177 @@ with open("colours.txt", 'r') as f:
 
 controls = []
 
-# integration time, microseconds
+# integration time, microseconds; applied to all spectrometers
+int_time_min, int_time_max = spectrometers.int_time_limits()
 int_time = Control('integration-time', "int. time (μs)",
                    "NumericInput",
                    {'id': 'integration-time-input',
-                    'max': spec.int_time_max(),
-                    'min': spec.int_time_min(),
+                    'max': int_time_max,
+                    'min': int_time_min,
                     'size': 150,
-                    'value': spec.int_time_min()
+                    'value': int_time_min
                     }
                    )
 controls.append(int_time)
 
+# scans averaged into each spectrum, by the spectrometer if it can
+scans_to_average = Control('scans-to-average', "scans to average",
+                           "NumericInput",
+                           {'id': 'scans-to-average-input',
+                            'max': 5000,
+                            'min': 1,
+                            'size': 150,
+                            'value': 1
+                            }
+                           )
+controls.append(scans_to_average)
+
+# boxcar smoothing, pixels either side of each pixel
+boxcar_width = Control('boxcar-width', "boxcar width",
+                       "NumericInput",
+                       {'id': 'boxcar-width-input',
+                        'max': 100,
+                        'min': 0,
+                        'size': 150,
+                        'value': 0
+                        }
+                       )
+controls.append(boxcar_width)
+
+############################
+# Live view
+############################
+
+# colour of each spectrometer's trace, in pool order
+def trace_colors():
+    return [colors['accent']] + [colors[name] for name in sorted(colors)
+                                 if name.startswith('trace-')]
+
+# the live plot is built with its layout and a placeholder axis, with one
+# trace per spectrometer, either overlaid on one set of axes or tiled in
+# rows with their own axes; after that only new intensities are streamed
+# to it. Each trace's meta is the serial number its frames are sent under
+def live_figure(serials, mode='overlay', view='intensity'):
+    x_axis = {
+            'title': 'Wavelength (nm)',
+            'titlefont': {
+                'family': 'Helvetica, sans-serif',
+                'color': colors['secondary']
+            },
+            'tickfont': {
+                'color': colors['tertiary']
+            },
+            'dtick': 100,
+            'color': colors['secondary'],
+            'gridcolor': colors['grid-colour']
+    }
+    y_axis = {
+        'title': VIEW_TITLES[view],
+        'titlefont': {
+            'family': 'Helvetica, sans-serif',
+            'color': colors['secondary']
+        },
+        'tickfont': {
+            'color': colors['tertiary']
+        },
+        'color': colors['secondary'],
+        'gridcolor': colors['grid-colour'],
+    }
+
+    tiled = mode == 'tile' and len(serials) > 1
+    palette = trace_colors()
+    wavelengths = numpy.linspace(400, 900, 5000)
+    traces = []
+    for i, serial in enumerate(serials):
+        suffix = str(i + 1) if tiled and i > 0 else ''
+        traces.append(go.Scatter(
+            x=wavelengths.tolist(),
+            y=[0 for wl in wavelengths],
+            name=serial,
+            meta=serial,
+            mode='lines',
+            xaxis='x' + suffix,
+            yaxis='y' + suffix,
+            line={
+                'width': 1,
+                'color': palette[i % len(palette)]
+            }
+        ))
+
+    layout = go.Layout(
+        height=max(600, 250 * len(serials)) if tiled else 600,
+        font={
+            'family': 'Helvetica Neue, sans-serif',
+            'size': 12
+        },
+        margin={
+            't': 20
+        },
+        titlefont={
+            'family': 'Helvetica, sans-serif',
+            'color': colors['primary'],
+            'size': 26
+        },
+        showlegend=len(serials) > 1,
+        xaxis=x_axis,
+        yaxis=y_axis,
+        paper_bgcolor=colors['background'],
+        plot_bgcolor=colors['background'],
+    )
+    if tiled:
+        layout.grid = {'rows': len(serials), 'columns': 1,
+                       'pattern': 'independent'}
+        for i in range(2, len(serials) + 1):
+            layout['xaxis%d' % i] = x_axis
+            layout['yaxis%d' % i] = y_axis
+
+    return go.Figure(data=traces, layout=layout)
+
+# time-resolved absorbance of one spectrometer, newest spectra at the top;
+# built empty, after which rows are appended as they are acquired
+def history_figure():
+    axis_font = {
+        'titlefont': {
+            'family': 'Helvetica, sans-serif',
+            'color': colors['secondary']
+        },
+        'tickfont': {
+            'color': colors['tertiary']
+        },
+        'color': colors['secondary'],
+        'gridcolor': colors['grid-colour']
+    }
+    heatmap = go.Heatmap(
+        x=[],
+        y=[],
+        z=[],
+        colorscale='RdBu',
+        reversescale=True,
+        zmid=0,
+        colorbar={'title': 'Absorbance'}
+    )
+    layout = go.Layout(
+        height=400,
+        font={
+            'family': 'Helvetica Neue, sans-serif',
+            'size': 12
+        },
+        margin={
+            't': 20
+        },
+        xaxis=dict(axis_font, title='Wavelength (nm)', dtick=100),
+        yaxis=dict(axis_font, title='Time (s)'),
+        paper_bgcolor=colors['background'],
+        plot_bgcolor=colors['background'],
+    )
+    return go.Figure(data=[heatmap], layout=layout)
+
+# spectra are sent as base64-encoded float32, about a seventh of the size of
+# the same numbers as JSON
+def encode_float32(values):
+    return base64.b64encode(
+        numpy.ascontiguousarray(values, dtype='<f4').tobytes()).decode('ascii')
+
 ############################
 # Layout
 ############################
@@ -306,14 +768,31 @@ page_layout = [html.Div(id='page', children=[
                             "ocean optics"
                         ]
                     ),
-                    dcc.Graph(id='spec-readings', animate=True),
+                    dcc.Graph(id='spec-readings',
+                              figure=live_figure(spectrometers.serials())),
+                    dcc.Store(id='spec-layout'),
+                    dcc.Store(id='spec-frame'),
+                    dcc.Store(id='spec-frame-sent'),
+                    # ticks only reach the server while the tab is visible
+                    # and the power is on; the period follows the
+                    # spectrometer and how fast the browser draws
                     dcc.Interval(
                         id='spec-reading-interval',
-                        interval=1 * 1000,
-                        n_intervals=0,
-                        max_intervals=300 # stop after 5 mins.
-                        # otherwise server has to handle callbacks for idle app
-                    )
+                        interval=REFRESH_MS['initial'],
+                        n_intervals=0
+                    ),
+                    dcc.Store(id='spec-tick'),
+                    dcc.Store(id='refresh-limits', data=REFRESH_MS)
+                ]
+            ),
+            # absorbance over time, appended to as spectra arrive
+            html.Div(
+                id='history-container',
+                children=[
+                    dcc.Graph(id='absorbance-history',
+                              figure=history_figure()),
+                    dcc.Store(id='history-rows'),
+                    dcc.Store(id='history-sent')
                 ]
             )
         ]
@@ -358,6 +837,107 @@ page_layout = [html.Div(id='page', children=[
                 ]
             ),
 
+            # overlay or tile the spectrometers
+            html.Div(
+                className='status-box-title',
+                children=[
+                    "spectrometers"
+                ]
+            ),
+            html.Div(
+                id='display-mode-container',
+                title='Shows the spectra of all connected spectrometers on \
+                one plot, or each on its own plot.',
+                children=[
+                    dcc.RadioItems(
+                        id='display-mode',
+                        options=[
+                            {'label': 'overlay', 'value': 'overlay'},
+                            {'label': 'tile', 'value': 'tile'}
+                        ],
+                        value='overlay'
+                    )
+                ]
+            ),
+
+            # spectrometer shown in the absorbance heat map
+            html.Div(
+                className='status-box-title',
+                children=[
+                    "kinetics"
+                ]
+            ),
+            html.Div(
+                id='history-device-container',
+                title='Spectrometer whose absorbance over time is shown \
+                below the spectra, once it has a reference spectrum.',
+                children=[
+                    dcc.RadioItems(
+                        id='history-device',
+                        options=[{'label': serial, 'value': serial}
+                                 for serial in spectrometers.serials()],
+                        value=spectrometers.serials()[0]
+                    )
+                ]
+            ),
+
+            # raw counts or corrected with the dark and reference spectra
+            html.Div(
+                className='status-box-title',
+                children=[
+                    "view"
+                ]
+            ),
+            html.Div(
+                id='view-mode-container',
+                title='Shows raw counts, or transmission or absorbance \
+                relative to the captured dark and reference spectra.',
+                children=[
+                    dcc.RadioItems(
+                        id='view-mode',
+                        options=[
+                            {'label': 'intensity', 'value': 'intensity'},
+                            {'label': 'transmission', 'value': 'transmission'},
+                            {'label': 'absorbance', 'value': 'absorbance'}
+                        ],
+                        value='intensity'
+                    )
+                ]
+            ),
+
+            # dark and reference capture
+            html.Div(
+                id='capture-container',
+                title='Averages the next spectra of every spectrometer into \
+                its dark or reference spectrum.',
+                children=[
+                    daq.NumericInput(
+                        id='capture-scans',
+                        label='scans',
+                        min=1,
+                        max=1000,
+                        size=75,
+                        value=10
+                    ),
+                    html.Button(
+                        'dark',
+                        id='dark-button',
+                        n_clicks=0
+                    ),
+                    html.Button(
+                        'reference',
+                        id='reference-button',
+                        n_clicks=0
+                    ),
+                    html.Div(
+                        id='capture-status',
+                        children=[
+                            ""
+                        ]
+                    )
+                ]
+            ),
+
             # submit button
             html.Div(
                 id='submit-button-container',
@@ -454,7 +1034,7 @@ def update_button_disable_enable(*args):
     [Input('power-button', 'on')]
 )
 def update_spec_model(_):
-    return "ocean optics %s" % spec.model()
+    return "ocean optics %s" % ', '.join(spectrometers.models())
 
 # disable/enable controls
 @app.callback(
@@ -487,7 +1067,7 @@ def update_spec_params(n_clicks, *args):
     commands = {controls[i].component_attr['id']: args[i]
                 for i in range(len(controls))}
 
-    failed, succeeded = spec.send_control_values(commands)
+    failed, succeeded = spectrometers.send_control_values(commands)
 
     summary = []
 
@@ -523,100 +1103,335 @@ def update_spec_params(n_clicks, *args):
 
     return html.Div(summary)
 
-# update the plot
+# figure layout for the selected display mode; the live view redraws the
+# spectra it already has into it
 @app.callback(
-    Output('spec-readings', 'figure'),
+    Output('spec-layout', 'data'),
+    [Input('display-mode', 'value'),
+     Input('view-mode', 'value')]
+)
+def update_figure_layout(mode, view):
+    return live_figure(spectrometers.serials(), mode, view).to_plotly_json()
+
+# capture dark or reference spectra on every spectrometer
+@app.callback(
+    Output('capture-status', 'children'),
+    [Input('dark-button', 'n_clicks'),
+     Input('reference-button', 'n_clicks')],
+    [State('capture-scans', 'value'),
+     State('power-button', 'on')]
+)
+def capture_references(dark_clicks, reference_clicks, n_scans, on):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if(not dark_clicks and not reference_clicks):
+        return ""
+    if(not on):
+        return "Turn the power on to capture spectra."
+    kind = 'dark' if 'dark-button.n_clicks' in triggered else 'reference'
+
+    failed = spectrometers.capture(kind, int(n_scans))
+    if len(failed) > 0:
+        return "No spectra from %s; %s not captured." % (', '.join(failed),
+                                                        kind)
+    return "%s captured (%d scans)." % (kind.capitalize(), int(n_scans))
+
+# send the newest spectrum of each spectrometer to the browser: only the
+# intensities, decimated to the display resolution and as base64 float32,
+# plus the wavelength axis when the browser doesn't have it yet.
+# Spectrometers without a new frame are left out
+@app.callback(
+    [Output('spec-frame', 'data'),
+     Output('spec-frame-sent', 'data')],
     inputs=[
-        Input('spec-reading-interval', 'n_intervals')
+        Input('spec-tick', 'data'),
+        Input('power-button', 'on'),
+        Input('view-mode', 'value')
     ],
     state=[
-        State('power-button', 'on'),
-        State('autoscale-switch', 'on')
+        State('spec-frame-sent', 'data')
     ]
 )
-def update_plot(_, on, auto_range):
-
-    traces = []
-    wavelengths = []
-    intensities = []
-
-    x_axis = {
-            'title': 'Wavelength (nm)',
-            'titlefont': {
-                'family': 'Helvetica, sans-serif',
-                'color': colors['secondary']
-            },
-            'tickfont': {
-                'color': colors['tertiary']
-            },
-            'dtick': 100,
-            'color': colors['secondary'],
-            'gridcolor': colors['grid-colour']
-    }
-    y_axis = {
-        'title': 'Intensity (A.U.)',
-        'titlefont': {
-            'family': 'Helvetica, sans-serif',
-            'color': colors['secondary']
-        },
-        'tickfont': {
-            'color': colors['tertiary']
-        },
-        'color': colors['secondary'],
-        'gridcolor': colors['grid-colour'],
-    }
+def update_frame(_, on, view, sent):
 
+    # read while the power is on and this viewer keeps asking; without
+    # viewers the spectrometers pause on their own after the keep-alive
     if(on):
-        spectrum = spec.get_spectrum()
-        wavelengths = spectrum[0]
-        intensities = spectrum[1]
+        spectrometers.resume()
     else:
-        wavelengths = numpy.linspace(400, 900, 5000)
-        intensities = [0 for wl in wavelengths]
+        spectrometers.pause()
+
+    sent_devices = {} if sent is None else sent['devices']
+    data = {}
+    devices = {}
+    periods = []
+    for serial in spectrometers.serials():
+        buffer = spectrometers.buffer(serial)
+        previous = sent_devices.get(serial)
+        frame = buffer.latest() if on else None
+        if(frame is None):
+            devices[serial] = {'frame': None, 'axis': None}
+            if(previous is None or previous['frame'] is not None):
+                data[serial] = {'frame': None}
+            continue
+
+        count, _, wavelengths, intensities = frame
+        axis = buffer.axis_version()
+        period = buffer.frame_period_ns()
+        if(period is not None):
+            periods.append(period / 1e6)
+        if(previous is not None and previous['frame'] == count and
+           previous.get('view') == view):
+            devices[serial] = previous
+            continue
+
+        # transmission and absorbance need a reference; until there is one
+        # the trace is blanked
+        values = spectrometers.view(serial, intensities, view)
+        if(values is None):
+            devices[serial] = {'frame': None, 'axis': None}
+            if(previous is None or previous['frame'] is not None):
+                data[serial] = {'frame': None}
+            continue
+        devices[serial] = {'frame': count, 'axis': axis, 'view': view}
+
+        # min/max decimation keeps peaks, and the autoscale range, intact
+        display_intensities = decimate_minmax(values, DISPLAY_BUCKETS)
+        data[serial] = {
+            'frame': count,
+            'y': encode_float32(display_intensities),
+            'range': {
+                'x': value_range(wavelengths),
+                'y': value_range(display_intensities)
+            }
+        }
+        if(previous is None or previous['axis'] != axis):
+            data[serial]['x'] = encode_float32(
+                decimate_axis(wavelengths, DISPLAY_BUCKETS))
+
+    if(not data):
+        return dash.no_update, dash.no_update
+    # tick as fast as the fastest spectrometer produces spectra
+    return {'devices': data}, {'devices': devices,
+                               'period_ms': min(periods) if periods else None}
+
+# send the absorbance rows of the selected spectrometer that the browser
+# doesn't have yet, as base64 float32; everything kept is sent instead when
+# the browser has none of it (first update, another spectrometer, or the
+# history started again)
+@app.callback(
+    [Output('history-rows', 'data'),
+     Output('history-sent', 'data')],
+    inputs=[
+        Input('spec-tick', 'data'),
+        Input('power-button', 'on'),
+        Input('history-device', 'value')
+    ],
+    state=[
+        State('history-sent', 'data')
+    ]
+)
+def update_history(_, on, serial, sent):
+    if(not on or serial is None):
+        return dash.no_update, dash.no_update
+
+    history = spectrometers.history(serial)
+    version = history.version()
+    reset = (sent is None or sent['serial'] != serial or
+             sent['version'] != version)
+    rows = history.rows_after(None if reset else sent['count'])
+    if(rows is None):
+        if(reset and sent is not None):
+            # nothing to show for this spectrometer yet: clear the map
+            return ({'reset': True, 'n_columns': 0},
+                    {'serial': serial, 'version': version, 'count': 0})
+        return dash.no_update, dash.no_update
+
+    count, wavelengths, times, values = rows
+    data = {
+        'reset': reset,
+        'n_columns': len(wavelengths),
+        'max_rows': history.n_rows,
+        't': encode_float32(times),
+        'z': encode_float32(values)
+    }
+    if(reset):
+        data['x'] = encode_float32(wavelengths)
+    return data, {'serial': serial, 'version': version, 'count': count}
+
+# pass interval ticks on to the server only while the tab is visible and the
+# power is on, so hidden or idle tabs cost the server nothing; polling picks up
+# again on its own when the tab is shown
+app.clientside_callback(
+    """
+    function(n, on) {
+        if (!on || document.hidden) {
+            return window.dash_clientside.no_update;
+        }
+        return n;
+    }
+    """,
+    Output('spec-tick', 'data'),
+    [Input('spec-reading-interval', 'n_intervals')],
+    [State('power-button', 'on')]
+)
 
-    if(on):
-        if(auto_range):
-            x_axis['range'] = [
-                min(wavelengths),
-                max(wavelengths)
-            ]
-            y_axis['range'] = [
-                min(intensities),
-                max(intensities)
-            ]
-    traces.append(go.Scatter(
-        x=wavelengths,
-        y=intensities,
-        name='Spectrometer readings',
-        mode='lines',
-        line={
-            'width': 1,
-            'color': colors['accent']
+# tick no faster than new spectra arrive or than the browser can draw them
+app.clientside_callback(
+    """
+    function(sent, limits, interval) {
+        if (!sent || sent.period_ms === undefined || sent.period_ms === null) {
+            return window.dash_clientside.no_update;
+        }
+        var renderMs = (window.specLiveView || {}).renderMs || 0;
+        var target = Math.max(sent.period_ms, 2 * renderMs, limits.min);
+        target = Math.round(Math.min(target, limits.max));
+        if (Math.abs(target - interval) < 0.1 * interval) {
+            return window.dash_clientside.no_update;
         }
-    ))
+        return target;
+    }
+    """,
+    Output('spec-reading-interval', 'interval'),
+    [Input('spec-frame-sent', 'data')],
+    [State('refresh-limits', 'data'),
+     State('spec-reading-interval', 'interval')]
+)
 
-    layout = go.Layout(
-        height=600,
-        font={
-            'family': 'Helvetica Neue, sans-serif',
-            'size': 12
-        },
-        margin={
-            't': 20
-        },
-        titlefont={
-            'family': 'Helvetica, sans-serif',
-            'color': colors['primary'],
-            'size': 26
-        },
-        xaxis=x_axis,
-        yaxis=y_axis,
-        paper_bgcolor=colors['background'],
-        plot_bgcolor=colors['background'],
-    )
+# decode the frames in the browser and swap them into the traces of their
+# spectrometers; the latest data of each is kept so that the figure can be
+# redrawn when the display mode changes
+app.clientside_callback(
+    """
+    function(data, template, figure, autoRange) {
+        if (!figure) {
+            return window.dash_clientside.no_update;
+        }
+        var ctx = window.dash_clientside.callback_context;
+        var fromLayout = ctx.triggered.length > 0 &&
+            ctx.triggered[0].prop_id === 'spec-layout.data';
+        if (fromLayout ? !template : !data) {
+            return window.dash_clientside.no_update;
+        }
+        function decode(b64) {
+            var bin = atob(b64);
+            var bytes = new Uint8Array(bin.length);
+            for (var i = 0; i < bin.length; i++) {
+                bytes[i] = bin.charCodeAt(i);
+            }
+            return new Float32Array(bytes.buffer);
+        }
+        var view = window.specLiveView = window.specLiveView || {};
+        var cache = view.devices = view.devices || {};
+        var devices = (!fromLayout && data.devices) || {};
+        Object.keys(devices).forEach(function(serial) {
+            var frame = devices[serial];
+            var entry = cache[serial] = cache[serial] || {};
+            if (frame.x) {
+                entry.x = decode(frame.x);
+            }
+            if (frame.frame === null) {
+                entry.y = null;
+                entry.range = null;
+            } else {
+                entry.y = decode(frame.y);
+                entry.range = frame.range;
+            }
+        });
+
+        var base = fromLayout ? template : figure;
+        var layout = Object.assign({}, base.layout);
+        // overlaid traces share axes, so their ranges are merged
+        var ranges = {};
+        function widen(name, range) {
+            if (!range) {
+                return;
+            }
+            var seen = ranges[name];
+            ranges[name] = seen ? [Math.min(seen[0], range[0]),
+                                   Math.max(seen[1], range[1])]
+                                : range.slice();
+        }
+        var traces = base.data.map(function(original) {
+            var trace = Object.assign({}, original);
+            var entry = cache[trace.meta];
+            if (entry && entry.x) {
+                trace.x = entry.x;
+            }
+            trace.y = (entry && entry.y) ? entry.y
+                                         : new Float32Array(trace.x.length);
+            if (entry && entry.range) {
+                widen('xaxis' + (trace.xaxis || 'x').slice(1), entry.range.x);
+                widen('yaxis' + (trace.yaxis || 'y').slice(1), entry.range.y);
+            }
+            return trace;
+        });
+        if (autoRange) {
+            Object.keys(ranges).forEach(function(name) {
+                layout[name] = Object.assign({}, layout[name],
+                                             {range: ranges[name]});
+            });
+        }
+        // time until the new figure has been drawn, for the refresh period
+        var start = performance.now();
+        window.requestAnimationFrame(function() {
+            window.requestAnimationFrame(function() {
+                view.renderMs = performance.now() - start;
+            });
+        });
+        return {data: traces, layout: layout};
+    }
+    """,
+    Output('spec-readings', 'figure'),
+    [Input('spec-frame', 'data'),
+     Input('spec-layout', 'data')],
+    [State('spec-readings', 'figure'),
+     State('autoscale-switch', 'on')]
+)
 
-    return {'data': traces,
-            'layout': layout}
+# add the new absorbance rows to the heat map with extendData, so only they
+# are sent and the browser keeps at most max_rows; the whole map is replaced
+# when the server starts it over
+app.clientside_callback(
+    """
+    function(rows, figure) {
+        var noUpdate = window.dash_clientside.no_update;
+        if (!rows || !figure) {
+            return [noUpdate, noUpdate];
+        }
+        function decode(b64) {
+            var bin = atob(b64);
+            var bytes = new Uint8Array(bin.length);
+            for (var i = 0; i < bin.length; i++) {
+                bytes[i] = bin.charCodeAt(i);
+            }
+            return new Float32Array(bytes.buffer);
+        }
+        var times = [];
+        var z = [];
+        if (rows.n_columns > 0) {
+            var flat = decode(rows.z);
+            times = Array.from(decode(rows.t));
+            for (var row = 0; row < times.length; row++) {
+                z.push(Array.from(flat.subarray(row * rows.n_columns,
+                                                (row + 1) * rows.n_columns)));
+            }
+        }
+        if (rows.reset) {
+            var trace = Object.assign({}, figure.data[0], {
+                x: rows.x ? Array.from(decode(rows.x)) : [],
+                y: times,
+                z: z
+            });
+            return [{data: [trace], layout: figure.layout}, noUpdate];
+        }
+        return [noUpdate, [{y: [times], z: [z]}, [0], rows.max_rows]];
+    }
+    """,
+    [Output('absorbance-history', 'figure'),
+     Output('absorbance-history', 'extendData')],
+    [Input('history-rows', 'data')],
+    [State('absorbance-history', 'figure')]
+)
 
 ############################
 # Run app
@@ -0,0 +1,434 @@
+import queue
+import threading
+import time
+
+import numpy
+
+
+# fixed-size ring of preallocated spectra, written by a single acquisition
+# thread and read by any number of viewers without taking a lock
+class SpectrumRingBuffer:
+    def __init__(self, n_pixels=0, size=4):
+        # readers copy the newest slot while the producer fills the next, so
+        # a single slot could never be read consistently
+        if size < 2:
+            raise ValueError('a ring buffer needs at least 2 slots')
+        self.size = size                  # number of frames kept
+        self._count = 0                   # completed frames; published last
+        self._axis_version = 0            # bumped when wavelengths change
+        self._allocate(n_pixels)
+
+    def _allocate(self, n_pixels):
+        self._wavelengths = numpy.zeros(n_pixels, dtype=numpy.float64)
+        self._frames = numpy.zeros((self.size, n_pixels), dtype=numpy.float64)
+        self._timestamps = numpy.zeros(self.size, dtype=numpy.int64)
+
+    # copies a spectrum into the next slot; only call from one thread
+    def push(self, wavelengths, intensities, timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        if len(intensities) != self._frames.shape[1]:
+            self._allocate(len(intensities))
+        slot = self._count % self.size
+        if not numpy.array_equal(self._wavelengths, wavelengths):
+            self._wavelengths[:] = wavelengths
+            self._axis_version += 1
+        self._frames[slot] = intensities
+        self._timestamps[slot] = timestamp_ns
+        self._count += 1
+
+    def count(self):
+        return self._count
+
+    # mean time between the frames held, or None before there are two
+    def frame_period_ns(self):
+        count = self._count
+        n = min(count, self.size)
+        if n < 2:
+            return None
+        newest = self._timestamps[(count - 1) % self.size]
+        oldest = self._timestamps[(count - n) % self.size]
+        return int(newest - oldest) // (n - 1)
+
+    # changes whenever the wavelength axis does, so viewers that already
+    # have the axis don't need it sent again
+    def axis_version(self):
+        return self._axis_version
+
+    # returns (frame number, timestamp, wavelengths, intensities) for the most
+    # recent completed frame, or None if nothing has been acquired yet
+    def latest(self):
+        while True:
+            count = self._count
+            if count == 0:
+                return None
+            slot = (count - 1) % self.size
+            wavelengths = self._wavelengths.copy()
+            intensities = self._frames[slot].copy()
+            timestamp = int(self._timestamps[slot])
+            # the producer only reuses this slot size - 1 frames later, so
+            # the copy is consistent unless we were lapped while copying
+            if self._count - count < self.size - 1:
+                return count, timestamp, wavelengths, intensities
+
+    # the most recent frame, as latest(), once it is newer than frame number
+    # count; waits for one until timeout (seconds), then returns None
+    def next_after(self, count, timeout=None, poll_seconds=0.005):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._count <= count:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_seconds)
+        return self.latest()
+
+
+# averages several scans into each spectrum and smooths it with a boxcar
+# that averages each pixel with boxcar_width pixels on either side (fewer at
+# the ends of the detector). Uses the spectrometer's own spectrum processing
+# where the model has it, so only the averaged spectrum crosses USB;
+# otherwise scans are summed into a preallocated accumulator. Either way only
+# the averaged spectrum is returned
+class SpectrumAverager:
+    def __init__(self, device, scans_to_average=1, boxcar_width=0):
+        self.device = device              # seabreeze Spectrometer
+        self.scans_to_average = None
+        self.boxcar_width = None
+        self.hardware = False             # averaging done by the spectrometer
+        self._processing = None           # spectrum processing feature
+        features = getattr(device, 'features', {})
+        if features.get('spectrum_processing'):
+            self._processing = features['spectrum_processing'][0]
+        self._wavelengths = None
+        self._sum = None                  # accumulator for the scans
+        self._cumsum = None               # running sum for the boxcar
+        self._window = None               # (lower, upper) running sums
+        self._bounds = None               # boxcar window of each pixel
+        self.configure(scans_to_average, boxcar_width)
+
+    # applies new settings; does nothing if they haven't changed
+    def configure(self, scans_to_average, boxcar_width):
+        scans_to_average = int(scans_to_average)
+        boxcar_width = int(boxcar_width)
+        if scans_to_average < 1:
+            raise ValueError('scans to average must be at least 1')
+        if boxcar_width < 0:
+            raise ValueError('boxcar width must be at least 0')
+        if (scans_to_average == self.scans_to_average and
+                boxcar_width == self.boxcar_width):
+            return
+
+        self.hardware = False
+        if self._processing is not None:
+            try:
+                self._processing.set_scans_to_average(scans_to_average)
+                self._processing.set_boxcar_width(boxcar_width)
+                self.hardware = True
+            except Exception:
+                # not supported by this firmware or backend after all; make
+                # sure the device isn't averaging as well before doing it here
+                processing, self._processing = self._processing, None
+                try:
+                    processing.set_scans_to_average(1)
+                    processing.set_boxcar_width(0)
+                except Exception:
+                    pass
+        self.scans_to_average = scans_to_average
+        self.boxcar_width = boxcar_width
+        self._bounds = None
+
+    def set_scans_to_average(self, scans_to_average):
+        self.configure(scans_to_average, self.boxcar_width)
+
+    def set_boxcar_width(self, boxcar_width):
+        self.configure(self.scans_to_average, boxcar_width)
+
+    # wavelengths and averaged intensities stacked, like device.spectrum()
+    def spectrum(self, correct_dark_counts=False, correct_nonlinearity=False):
+        if self.hardware or (self.scans_to_average == 1 and
+                             self.boxcar_width == 0):
+            return self.device.spectrum(
+                correct_dark_counts=correct_dark_counts,
+                correct_nonlinearity=correct_nonlinearity)
+
+        if self._wavelengths is None:
+            self._wavelengths = numpy.asarray(self.device.wavelengths())
+        n_pixels = len(self._wavelengths)
+        if self._sum is None or len(self._sum) != n_pixels:
+            self._sum = numpy.empty(n_pixels, dtype=numpy.float64)
+            self._cumsum = numpy.zeros(n_pixels + 1, dtype=numpy.float64)
+            self._window = numpy.empty((2, n_pixels), dtype=numpy.float64)
+            self._bounds = None
+
+        self._sum[:] = self.device.intensities(
+            correct_dark_counts=correct_dark_counts,
+            correct_nonlinearity=correct_nonlinearity)
+        for _ in range(self.scans_to_average - 1):
+            self._sum += self.device.intensities(
+                correct_dark_counts=correct_dark_counts,
+                correct_nonlinearity=correct_nonlinearity)
+
+        spectrum = numpy.empty((2, n_pixels), dtype=numpy.float64)
+        spectrum[0] = self._wavelengths
+        numpy.divide(self._sum, self.scans_to_average, out=spectrum[1])
+        if self.boxcar_width:
+            self._boxcar(spectrum[1])
+        return spectrum
+
+    # moving average in place, from differences of a running sum
+    def _boxcar(self, values):
+        n_pixels = len(values)
+        if self._bounds is None:
+            pixels = numpy.arange(n_pixels)
+            lower = numpy.maximum(pixels - self.boxcar_width, 0)
+            upper = numpy.minimum(pixels + self.boxcar_width + 1, n_pixels)
+            self._bounds = (lower, upper, (upper - lower).astype(numpy.float64))
+        lower, upper, counts = self._bounds
+        numpy.cumsum(values, out=self._cumsum[1:])
+        numpy.take(self._cumsum, upper, out=self._window[1])
+        numpy.take(self._cumsum, lower, out=self._window[0])
+        numpy.subtract(self._window[1], self._window[0], out=values)
+        values /= counts
+
+
+# reads a spectrometer continuously into a SpectrumRingBuffer, so that
+# callbacks never wait for an integration period. Every spectrum is also
+# handed to processor (anything with append(spectrum, timestamp), such as
+# AbsorbanceHistory), if given. After failed reads (e.g. nothing connected)
+# the wait before trying again doubles, up to max_idle_seconds, so a missing
+# spectrometer isn't looked for many times a second
+class AcquisitionThread(threading.Thread):
+    def __init__(self, spec, buffer, idle_seconds=0.1, processor=None,
+                 max_idle_seconds=5.0):
+        super().__init__(daemon=True)
+        self.spec = spec                  # any DashOceanOpticsSpectrometer
+        self.buffer = buffer
+        self.processor = processor
+        self.idle_seconds = idle_seconds  # wait while paused or failing
+        self.max_idle_seconds = max_idle_seconds
+        self._acquiring = threading.Event()
+        self._stopping = threading.Event()
+        self._until = None                # monotonic time to pause at
+
+    def run(self):
+        previous = None
+        failures = 0
+        while not self._stopping.is_set():
+            if not self._acquiring.wait(self.idle_seconds):
+                continue
+            until = self._until
+            if until is not None and time.monotonic() >= until:
+                self._acquiring.clear()
+                continue
+            spectrum = self.spec.get_spectrum()
+            # on a failed read the spectrometer hands back its last data
+            if spectrum is previous or len(spectrum[0]) == 0:
+                delay = min(self.idle_seconds * 2**failures,
+                            self.max_idle_seconds)
+                failures += 1
+                # stop() ends the wait early
+                self._stopping.wait(delay)
+                continue
+            failures = 0
+            previous = spectrum
+            timestamp = time.monotonic_ns()
+            self.buffer.push(spectrum[0], spectrum[1], timestamp)
+            if self.processor is not None:
+                self.processor.append(spectrum, timestamp)
+
+    # reads until paused, or for the next seconds only, if given; calling
+    # it again moves the deadline, so callers can keep it reading for as
+    # long as they keep asking
+    def resume(self, seconds=None):
+        self._until = None if seconds is None else time.monotonic() + seconds
+        self._acquiring.set()
+
+    def pause(self):
+        self._acquiring.clear()
+
+    def is_acquiring(self):
+        return self._acquiring.is_set()
+
+    def stop(self):
+        self._stopping.set()
+        self._acquiring.clear()
+
+
+# paces timed acquisitions against absolute deadlines on the monotonic clock,
+# start + n * interval, so the period doesn't stretch by the integration time
+# and I/O of each sample and errors don't accumulate over long runs
+class SampleScheduler:
+    def __init__(self, interval_seconds, start_ns=None):
+        self.interval_ns = int(round(interval_seconds * 1e9))
+        self.start_ns = start_ns          # deadline of the first sample
+        self.n_samples = 0
+        self.missed = 0                   # deadlines skipped entirely
+        self._slot = 0                    # index of the next deadline
+        self._lateness_ns = []
+
+    # blocks until the next deadline and returns the time.monotonic_ns() the
+    # sample was triggered at and how late that was; the first call returns
+    # immediately. If a whole period has already passed, the deadlines that
+    # can't be met are skipped and counted as missed instead of being caught
+    # up in a burst
+    def wait(self):
+        now = time.monotonic_ns()
+        if self.start_ns is None:
+            self.start_ns = now
+        deadline = self.start_ns + self._slot * self.interval_ns
+        if self.interval_ns > 0 and now - deadline >= self.interval_ns:
+            skipped = (now - deadline) // self.interval_ns
+            self.missed += skipped
+            self._slot += skipped
+            deadline += skipped * self.interval_ns
+        while now < deadline:
+            time.sleep((deadline - now) / 1e9)
+            now = time.monotonic_ns()
+        lateness = now - deadline
+        self._slot += 1
+        self.n_samples += 1
+        self._lateness_ns.append(lateness)
+        return now, lateness
+
+    def lateness_ns(self):
+        return numpy.array(self._lateness_ns, dtype=numpy.int64)
+
+    # summary of how well the deadlines were kept
+    def metrics(self):
+        lateness = self.lateness_ns()
+        if len(lateness) == 0:
+            lateness = numpy.zeros(1, dtype=numpy.int64)
+        return {
+            'samples': self.n_samples,
+            'missed_deadlines': int(self.missed),
+            'mean_lateness_s': float(lateness.mean()) / 1e9,
+            'max_lateness_s': float(lateness.max()) / 1e9,
+        }
+
+
+# runs the camera and the spectrometer in their own threads, both triggered on
+# the same grid of deadlines, so they integrate concurrently and the cycle time
+# is the slower of the two rather than their sum. Readings are paired by
+# trigger time and written by a third stage fed through a bounded queue, which
+# holds the workers back if writing falls behind. That stage also hands each
+# spectrum to processor (anything with append(spectrum, timestamp), such as
+# OnlineAbsorbance), if given, and calls progress(pairs written, n_samples)
+# after each pair
+class PipelinedAcquisition:
+    def __init__(self, read_spectrum, read_frame, writer, n_samples,
+                 interval_seconds, max_skew_seconds=None, queue_size=16,
+                 processor=None, progress=None):
+        if max_skew_seconds is None:
+            if interval_seconds <= 0:
+                raise ValueError('max_skew_seconds is needed to pair '
+                                 'free-running devices')
+            max_skew_seconds = interval_seconds / 2
+        self.read_spectrum = read_spectrum
+        self.read_frame = read_frame
+        self.writer = writer              # RunWriter
+        self.processor = processor
+        self.progress = progress
+        self.n_samples = n_samples        # readings per device
+        self.interval_seconds = interval_seconds
+        self.max_skew_ns = int(max_skew_seconds * 1e9)
+        self.n_pairs = 0
+        self.unpaired = {'spectrum': 0, 'frame': 0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._errors = []
+        self._schedulers = {}
+
+    def stop(self):
+        self._stopping.set()
+
+    def _worker(self, source, read, start_ns):
+        scheduler = SampleScheduler(self.interval_seconds, start_ns)
+        self._schedulers[source] = scheduler
+        try:
+            for _ in range(self.n_samples):
+                if self._stopping.is_set():
+                    break
+                trigger_ns, lateness_ns = scheduler.wait()
+                self._queue.put((source, trigger_ns, lateness_ns, read()))
+        except Exception as e:
+            self._errors.append(e)
+            self._stopping.set()
+        finally:
+            self._queue.put((source, None, None, None))
+
+    # readings arrive in time order from each worker; a reading further than
+    # max_skew from the other device's oldest pending one can never be paired
+    def _pair(self, pending):
+        paired = []
+        while pending['spectrum'] and pending['frame']:
+            spectrum = pending['spectrum'][0]
+            frame = pending['frame'][0]
+            skew = spectrum[0] - frame[0]
+            if abs(skew) <= self.max_skew_ns:
+                pending['spectrum'].pop(0)
+                pending['frame'].pop(0)
+                paired.append((spectrum, frame))
+            elif skew < 0:
+                pending['spectrum'].pop(0)
+                self.unpaired['spectrum'] += 1
+            else:
+                pending['frame'].pop(0)
+                self.unpaired['frame'] += 1
+        return paired
+
+    # blocks until both devices have taken n_samples readings (or stop() is
+    # called) and everything paired has been written; returns metrics. If
+    # writing or processing fails, the workers are stopped and the queue
+    # drained so they can finish before the error is raised
+    def run(self):
+        start_ns = time.monotonic_ns()
+        workers = [
+            threading.Thread(target=self._worker,
+                             args=('spectrum', self.read_spectrum, start_ns),
+                             daemon=True),
+            threading.Thread(target=self._worker,
+                             args=('frame', self.read_frame, start_ns),
+                             daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        pending = {'spectrum': [], 'frame': []}
+        running = len(workers)
+        try:
+            while running:
+                source, trigger_ns, lateness_ns, data = self._queue.get()
+                if trigger_ns is None:
+                    running -= 1
+                    continue
+                pending[source].append((trigger_ns, lateness_ns, data))
+                for spectrum, frame in self._pair(pending):
+                    self.writer.append(spectrum=spectrum[2], image=frame[2],
+                                       timestamp=spectrum[0],
+                                       lateness_ns=max(spectrum[1], frame[1]))
+                    if self.processor is not None:
+                        self.processor.append(spectrum[2], spectrum[0])
+                    self.n_pairs += 1
+                    if self.progress is not None:
+                        self.progress(self.n_pairs, self.n_samples)
+        finally:
+            self.stop()
+            # a worker blocked on a full queue needs room for its end marker
+            while running:
+                if self._queue.get()[1] is None:
+                    running -= 1
+            for worker in workers:
+                worker.join()
+        self.unpaired['spectrum'] += len(pending['spectrum'])
+        self.unpaired['frame'] += len(pending['frame'])
+        if self._errors:
+            raise self._errors[0]
+        return self.metrics()
+
+    def metrics(self):
+        metrics = {'pairs': self.n_pairs,
+                   'unpaired_spectra': self.unpaired['spectrum'],
+                   'unpaired_frames': self.unpaired['frame']}
+        for source, scheduler in self._schedulers.items():
+            for key, value in scheduler.metrics().items():
+                metrics['%s_%s' % (source, key)] = value
+        return metrics
@@ -0,0 +1,72 @@
+# compares what update_frame sends per tick, and how long it takes, with the
+# spectrum sent in full and min/max-decimated for display, at several pixel
+# counts; runs without a spectrometer
+#
+# usage (from the repository root):
+#     python benchmarks/display_decimation.py
+
+import importlib.util
+import json
+import os
+import sys
+import time
+from threading import Lock
+
+import numpy
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+APP_PATH = os.path.join(ROOT, 'Spectrometer-Control-App.py')
+sys.path.insert(0, ROOT)
+
+def load_app():
+    spec = importlib.util.spec_from_file_location('spectrometer_control_app',
+                                                  APP_PATH)
+    app = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    os.chdir(ROOT)                         # app reads colours.txt
+    try:
+        spec.loader.exec_module(app)
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+def synthetic_spectrum(n_pixels, rng):
+    wavelengths = numpy.linspace(200, 1100, n_pixels)
+    intensities = (30000 * numpy.exp(-((wavelengths - 600) / 80)**2) +
+                   500 * rng.random(n_pixels))
+    intensities[n_pixels // 3] = 60000     # one-pixel peak
+    return wavelengths, intensities
+
+
+# mean time and payload size of one tick that sends intensities only
+def measure(app, n_buckets, repeats=200):
+    app.DISPLAY_BUCKETS = n_buckets
+    sent = None
+    data, sent = app.update_frame(0, True, 'intensity', sent)   # first tick sends the axis
+    for device in sent['devices'].values():
+        device['frame'] = -1
+    start = time.perf_counter()
+    for _ in range(repeats):
+        data, _ = app.update_frame(0, True, 'intensity', sent)
+    elapsed = (time.perf_counter() - start) / repeats
+    return len(json.dumps(data)), elapsed
+
+
+if __name__ == '__main__':
+    app = load_app()
+    rng = numpy.random.default_rng(0)
+    print('%8s  %22s  %22s' % ('pixels', 'full (bytes, ms)',
+                               'decimated (bytes, ms)'))
+    for n_pixels in (2000, 5000, 100000):
+        # one spectrometer whose acquisition thread is never started, so
+        # nothing is read and the buffer only holds the synthetic spectrum
+        app.spectrometers = app.SpectrometerPool()
+        app.spectrometers.add('bench', app.DemoSpectrometer(Lock(), Lock()))
+        app.spectrometers.buffer('bench').push(
+            *synthetic_spectrum(n_pixels, rng))
+
+        full_bytes, full_time = measure(app, n_pixels)
+        bytes_, time_ = measure(app, 1000)
+        print('%8d  %12d %9.3f  %12d %9.3f'
+              % (n_pixels, full_bytes, 1e3 * full_time, bytes_, 1e3 * time_))
@@ -0,0 +1,64 @@
+# draws a synthetic absorbance map (time x wavelength) with heatmap.heatmap
+# and reports the time to bin and render it, for runs of increasing length;
+# the wavelength axis is a spectrometer-like polynomial and the sample times
+# are jittered, so both axes are unevenly spaced. contourf, as the reader
+# notebook used before, is timed on the shortest run only
+#
+# usage (from the repository root):
+#     python benchmarks/heatmap_rendering.py [samples ...]
+
+import os
+import sys
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy
+from matplotlib.ticker import MaxNLocator
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from heatmap import heatmap, shifted_cmap
+
+PIXELS = 1320                             # trimmed pixels of a USB spectrometer
+
+
+def synthetic_map(n_samples, rng):
+    pixel = numpy.arange(PIXELS)
+    wavelengths = 420.9 + 0.26 * pixel - 1.5e-5 * pixel**2
+    times = numpy.cumsum(rng.uniform(0.08, 0.12, n_samples))
+    peak = numpy.exp(-((wavelengths - 600) / 40)**2)
+    values = numpy.empty((n_samples, PIXELS))
+    values[:] = peak
+    values *= (1 - numpy.exp(-times / times[-1] * 5))[:, None]
+    values += rng.normal(0, 0.02, values.shape)
+    return wavelengths, times, values
+
+
+def render(draw):
+    fig, ax = plt.subplots()
+    start = time.perf_counter()
+    plt.colorbar(draw(ax))
+    fig.canvas.draw()
+    elapsed = time.perf_counter() - start
+    plt.close(fig)
+    return elapsed
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [2000, 20000, 100000]
+    rng = numpy.random.default_rng(0)
+    cmap = shifted_cmap(-0.5, 0.5, 0, reverse=True)
+
+    print('%8s  %10s  %10s' % ('samples', 'heatmap s', 'contourf s'))
+    for i, n_samples in enumerate(sizes):
+        x, y, z = synthetic_map(n_samples, rng)
+        fast = render(lambda ax: heatmap(ax, x, y, z, -0.5, 0.5, cmap))
+        slow = ''
+        if i == 0:
+            levels = MaxNLocator(nbins=25).tick_values(-0.5, 0.5)
+            slow = '%10.2f' % render(
+                lambda ax: ax.contourf(x, y, z, cmap=cmap, levels=levels))
+        print('%8d  %10.2f  %10s' % (n_samples, fast, slow))
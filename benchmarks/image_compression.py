@@ -0,0 +1,70 @@
+# writes synthetic camera frames through RunWriter with each image codec and
+# reports the write speed (MB/s of raw frames) and the compression ratio; the
+# frames are a smooth illumination profile plus shot noise, at the camera's
+# ROI size, as 12-bit mono and 8-bit RGB
+#
+# usage (from the repository root):
+#     python benchmarks/image_compression.py [frames]
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from h5_storage import IMAGE_CODECS, RunWriter, hdf5plugin
+
+HEIGHT, WIDTH = 1076, 1340               # default ROI of CameraSession
+
+
+def synthetic_frames(n_frames, channels, dtype, full_scale, rng):
+    y, x = numpy.mgrid[0:HEIGHT, 0:WIDTH]
+    profile = numpy.exp(-(((x - WIDTH / 2) / (WIDTH / 3))**2 +
+                          ((y - HEIGHT / 2) / (HEIGHT / 3))**2))
+    frames = []
+    for i in range(n_frames):
+        mean = 0.6 * full_scale * profile * (1 - 0.01 * i) + 0.02 * full_scale
+        if channels:
+            mean = mean[..., None] * numpy.array([1.0, 0.8, 0.6])
+        frame = rng.poisson(mean).clip(0, full_scale).astype(dtype)
+        frames.append(frame)
+    return frames
+
+
+def measure(frames, codec, level, path):
+    start = time.perf_counter()
+    with RunWriter(path, image_codec=codec, image_level=level) as writer:
+        for frame in frames:
+            writer.append(image=frame)
+    elapsed = time.perf_counter() - start
+    raw = sum(frame.nbytes for frame in frames)
+    return raw / elapsed / 1e6, raw / os.path.getsize(path)
+
+
+if __name__ == '__main__':
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = numpy.random.default_rng(0)
+    cases = [('12-bit mono', synthetic_frames(n_frames, 0, numpy.uint16,
+                                               4095, rng)),
+             ('8-bit RGB', synthetic_frames(n_frames, 3, numpy.uint8,
+                                             255, rng))]
+    settings = [(codec, None) for codec in IMAGE_CODECS]
+    settings += [('shuffle+gzip', 1), ('shuffle+gzip', 9), ('blosc', 9)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'images.h5')
+        for name, frames in cases:
+            print('%s, %d frames of %s' % (name, n_frames, frames[0].shape))
+            print('%16s %6s  %8s  %6s' % ('codec', 'level', 'MB/s', 'ratio'))
+            for codec, level in settings:
+                if codec == 'blosc' and hdf5plugin is None:
+                    print('%16s %6s  (needs hdf5plugin)' % (codec, ''))
+                    continue
+                speed, ratio = measure(frames, codec, level, path)
+                print('%16s %6s  %8.1f  %6.2f'
+                      % (codec, '' if level is None else level, speed, ratio))
+            print()
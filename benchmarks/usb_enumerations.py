@@ -0,0 +1,86 @@
+# counts how often the app enumerates the USB bus while starting up and while
+# serving a page load; the spectrometer is replaced by a fake that only counts
+#
+# usage (from the repository root):
+#     python benchmarks/usb_enumerations.py
+
+import importlib.util
+import os
+import sys
+import time
+
+import numpy
+import seabreeze.spectrometers
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+APP_PATH = os.path.join(ROOT, 'Spectrometer-Control-App.py')
+sys.path.insert(0, ROOT)
+
+counts = {'list_devices': 0, 'open': 0}
+
+
+class FakeSpectrometer:
+    model = 'USB2000PLUS'
+    serial_number = 'FAKE0001'
+    integration_time_micros_limits = (1000, 65000000)
+
+    def __init__(self, device):
+        counts['open'] += 1
+
+    def spectrum(self, correct_dark_counts=False, correct_nonlinearity=True):
+        wavelengths = numpy.linspace(400, 900, 5000)
+        return numpy.vstack((wavelengths, numpy.zeros_like(wavelengths)))
+
+    def integration_time_micros(self, value):
+        return
+
+    def close(self):
+        return
+
+
+class FakeDevice:
+    serial_number = 'FAKE0001'
+
+
+def fake_list_devices():
+    counts['list_devices'] += 1
+    return [FakeDevice()]
+
+
+def load_app():
+    seabreeze.spectrometers.list_devices = fake_list_devices
+    seabreeze.spectrometers.Spectrometer = FakeSpectrometer
+    spec = importlib.util.spec_from_file_location('spectrometer_control_app',
+                                                  APP_PATH)
+    app = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    os.chdir(ROOT)                         # app reads colours.txt
+    try:
+        spec.loader.exec_module(app)
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+# the callbacks Dash fires when a page is (re)loaded and the power is toggled
+def page_load(app):
+    app.update_spec_model(False)
+    app.disable_enable_controls(False)
+    app.update_spec_model(True)
+    app.disable_enable_controls(True)
+
+
+if __name__ == '__main__':
+    app = load_app()
+    print('startup: %d enumerations, %d device opens'
+          % (counts['list_devices'], counts['open']))
+
+    n_loads = 100
+    counts['list_devices'] = counts['open'] = 0
+    start = time.perf_counter()
+    for _ in range(n_loads):
+        page_load(app)
+    elapsed = time.perf_counter() - start
+    print('page load: %.2f enumerations, %.2f device opens, %.1f μs per load'
+          % (counts['list_devices'] / n_loads, counts['open'] / n_loads,
+             1e6 * elapsed / n_loads))
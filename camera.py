@@ -0,0 +1,108 @@
+from pylablib.devices import Thorlabs
+
+
+# one open connection to a Thorlabs camera that is reused for every frame;
+# opening and closing the camera takes hundreds of ms, so it stays open (and
+# acquiring, once started) until close() or the end of a with block
+class CameraSession:
+    def __init__(self, serial_id, exposure, roi=(100,1440,4,1080,1,1),
+                 nframes=100):
+        self.serial_id = serial_id
+        self.exposure = exposure          # seconds
+        self.roi = roi
+        self.nframes = nframes            # frame buffer size
+        self.model = ''
+        self.roi_x_limit = (0,1)
+        self.roi_y_limit = (0,1)
+        self._cam = None
+        self._acquisition_ready = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_open(self):
+        return self._cam is not None and self._cam.is_opened()
+
+    # opens the camera once and reads the properties that don't change
+    def open(self):
+        if self.is_open():
+            return
+        self._cam = Thorlabs.ThorlabsTLCamera(serial=self.serial_id)
+        self.model = self._cam.get_device_info()[0]
+        self._cam.set_exposure(self.exposure)
+        self._cam.set_roi(*self.roi)
+        roi_limits = self._cam.get_roi_limits()
+        self.roi_x_limit = (roi_limits[0][0], roi_limits[0][1])
+        self.roi_y_limit = (roi_limits[1][0], roi_limits[1][1])
+        self._acquisition_ready = False
+
+    def close(self):
+        if self._cam is None:
+            return
+        try:
+            if self._cam.acquisition_in_progress():
+                self._cam.stop_acquisition()
+        finally:
+            self._cam.close()
+            self._cam = None
+            self._acquisition_ready = False
+
+    # applied to the running camera; frames taken after this call use it
+    def set_exposure(self, exposure):
+        self.exposure = exposure
+        self.open()
+        self._cam.set_exposure(exposure)
+
+    def get_frame_timings(self):
+        self.open()
+        return self._cam.get_frame_timings()
+
+    def get_roi(self):
+        self.open()
+        return self._cam.get_roi()
+
+    # sets up the frame buffer once; later starts reuse it
+    def setup_acquisition(self):
+        self.open()
+        if not self._acquisition_ready:
+            self._cam.setup_acquisition(nframes=self.nframes)
+            self._acquisition_ready = True
+
+    def start_acquisition(self):
+        self.setup_acquisition()
+        if not self._cam.acquisition_in_progress():
+            self._cam.start_acquisition()
+
+    def stop_acquisition(self):
+        if self.is_open() and self._cam.acquisition_in_progress():
+            self._cam.stop_acquisition()
+
+    # starts afresh, dropping any frames still in the buffer, so a run
+    # doesn't begin with frames taken before it (at another exposure)
+    def restart_acquisition(self):
+        self.stop_acquisition()
+        self.start_acquisition()
+
+    # oldest frame that hasn't been read yet, waiting for one if needed
+    def read_frame(self, timeout=20.0):
+        self.start_acquisition()
+        self._cam.wait_for_frame(timeout=timeout)
+        return self._cam.read_oldest_image()
+
+    # a frame finished after this call, so it reflects the current exposure;
+    # an acquisition started just for it is stopped again, so an idle
+    # session doesn't keep streaming frames
+    def snap(self, timeout=20.0):
+        self.open()
+        running = self._cam.acquisition_in_progress()
+        self.start_acquisition()
+        try:
+            self._cam.wait_for_frame(since="now", timeout=timeout)
+            return self._cam.read_newest_image()
+        finally:
+            if not running:
+                self._cam.stop_acquisition()
@@ -0,0 +1,92 @@
+import numpy
+
+
+# dark and reference spectra of one spectrometer, kept in memory so each new
+# spectrum can be corrected as it arrives. Counts are clamped as in
+# load_absorbance: negative dark counts are taken as 0, and negative
+# reference and sample counts as 1, so that log10 stays defined
+class ReferenceSpectra:
+    def __init__(self):
+        self.wavelengths = None
+        self.dark = None
+        self.reference = None
+        self._span = None                 # reference - dark
+
+    def set_dark(self, wavelengths, intensities):
+        self._check_axis(wavelengths)
+        dark = numpy.array(intensities, dtype=numpy.float64)
+        dark[dark < 0] = 0
+        self.dark = dark
+        self._update_span()
+
+    def set_reference(self, wavelengths, intensities):
+        self._check_axis(wavelengths)
+        reference = numpy.array(intensities, dtype=numpy.float64)
+        reference[reference < 0] = 1
+        self.reference = reference
+        self._update_span()
+
+    # a new wavelength axis makes the other spectrum meaningless
+    def _check_axis(self, wavelengths):
+        wavelengths = numpy.array(wavelengths, dtype=numpy.float64)
+        if (self.wavelengths is None or
+                not numpy.array_equal(self.wavelengths, wavelengths)):
+            self.wavelengths = wavelengths
+            self.dark = None
+            self.reference = None
+
+    def _update_span(self):
+        if self.reference is None:
+            self._span = None
+            return
+        self._span = self.reference - self.dark_or_zero()
+        self._span[self._span == 0] = numpy.nan
+
+    def dark_or_zero(self):
+        if self.dark is None:
+            return numpy.zeros_like(self.reference)
+        return self.dark
+
+    # transmission needs a reference; the dark spectrum is optional
+    def ready(self):
+        return self._span is not None
+
+    # (sample - dark) / (reference - dark) for one spectrum or a stack of
+    # them (N, pixels); out may be the input, for an in-place correction.
+    # Pixels where the reference equals the dark are NaN
+    def transmission(self, intensities, out=None):
+        if not self.ready():
+            raise ValueError('no reference spectrum')
+        intensities = numpy.asarray(intensities, dtype=numpy.float64)
+        if intensities.shape[-1] != len(self._span):
+            raise ValueError('spectrum has %d pixels, reference has %d'
+                             % (intensities.shape[-1], len(self._span)))
+        if out is None:
+            out = intensities.copy()
+        elif out is not intensities:
+            out[...] = intensities
+        out[out < 0] = 1
+        if self.dark is not None:
+            out -= self.dark
+        out /= self._span
+        return out
+
+    # -log10 of the transmission; pixels without a finite absorbance are NaN
+    def absorbance(self, intensities, out=None):
+        out = self.transmission(intensities, out)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            numpy.log10(out, out=out)
+        out *= -1
+        out[~numpy.isfinite(out)] = numpy.nan
+        return out
+
+
+# averages n_scans spectra from read_spectrum, which returns (wavelengths,
+# intensities), in one preallocated accumulator
+def average_spectra(read_spectrum, n_scans):
+    wavelengths, intensities = read_spectrum()[:2]
+    total = numpy.array(intensities, dtype=numpy.float64)
+    for _ in range(n_scans - 1):
+        total += read_spectrum()[1]
+    total /= n_scans
+    return numpy.array(wavelengths, dtype=numpy.float64), total
@@ -0,0 +1,82 @@
+import numpy
+
+
+# min-max decimation of spectra for display: each run of pixels (a bucket,
+# about one screen pixel wide) becomes two points, its minimum and maximum in
+# the order they occur, so narrow peaks survive. The two points sit at the
+# first and last wavelength of the bucket, which doesn't depend on the data,
+# so the decimated axis stays the same from frame to frame
+
+def bucket_size(n_pixels, n_buckets):
+    return max(1, -(-n_pixels // n_buckets))
+
+
+# decimated wavelength axis; spectra short enough to show in full are
+# returned unchanged
+def decimate_axis(wavelengths, n_buckets):
+    wavelengths = numpy.asarray(wavelengths)
+    n = len(wavelengths)
+    if n <= 2 * n_buckets:
+        return wavelengths
+    size = bucket_size(n, n_buckets)
+    starts = numpy.arange(0, n, size)
+    ends = numpy.minimum(starts + size, n) - 1
+    return numpy.column_stack((wavelengths[starts],
+                               wavelengths[ends])).ravel()
+
+
+# decimated intensities, matching decimate_axis; NaNs are ignored unless a
+# whole bucket is NaN
+def decimate_minmax(intensities, n_buckets):
+    intensities = numpy.asarray(intensities, dtype=numpy.float64)
+    n = len(intensities)
+    if n <= 2 * n_buckets:
+        return intensities
+    size = bucket_size(n, n_buckets)
+    n_rows = -(-n // size)
+    # pad the last bucket with its own last value so it can't add extremes
+    buckets = numpy.empty(n_rows * size)
+    buckets[:n] = intensities
+    buckets[n:] = intensities[-1]
+    buckets = buckets.reshape(n_rows, size)
+
+    if numpy.isnan(intensities).any():
+        missing = numpy.isnan(buckets)
+        i_min = numpy.where(missing, numpy.inf, buckets).argmin(axis=1)
+        i_max = numpy.where(missing, -numpy.inf, buckets).argmax(axis=1)
+    else:
+        i_min = buckets.argmin(axis=1)
+        i_max = buckets.argmax(axis=1)
+    rows = numpy.arange(n_rows)
+    first = buckets[rows, numpy.minimum(i_min, i_max)]
+    second = buckets[rows, numpy.maximum(i_min, i_max)]
+    return numpy.column_stack((first, second)).ravel()
+
+
+# mean of each bucket, for images such as heat maps where each column can
+# only show one value; wavelengths averaged the same way give the bucket
+# centres. NaNs are ignored unless a whole bucket is NaN
+def decimate_mean(values, n_buckets):
+    values = numpy.asarray(values, dtype=numpy.float64)
+    n = len(values)
+    if n <= n_buckets:
+        return values.copy()
+    size = bucket_size(n, n_buckets)
+    n_rows = -(-n // size)
+    buckets = numpy.full(n_rows * size, numpy.nan)
+    buckets[:n] = values
+    buckets = buckets.reshape(n_rows, size)
+    finite = numpy.isfinite(buckets)
+    sums = numpy.where(finite, buckets, 0).sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return sums / finite.sum(axis=1)
+
+
+# [min, max] ignoring NaNs, as plain floats for the browser, or None if
+# there are no finite values
+def value_range(values):
+    values = numpy.asarray(values)
+    finite = values[numpy.isfinite(values)]
+    if len(finite) == 0:
+        return None
+    return [float(finite.min()), float(finite.max())]
@@ -0,0 +1,105 @@
+import numpy
+import pandas as pd
+
+from correction import ReferenceSpectra
+from savgol import savgol_smooth
+
+# wavelength window (nm) kept when trimming spectra
+WAV_MIN = 420.8844873459128
+WAV_MAX = 750.9364930772199
+
+
+# index range of wavelengths between wav_min and wav_max (inclusive), for a
+# sorted wavelength axis
+def wavelength_slice(wavelengths, wav_min=WAV_MIN, wav_max=WAV_MAX):
+    start = numpy.searchsorted(wavelengths, wav_min, side='left')
+    stop = numpy.searchsorted(wavelengths, wav_max, side='right')
+    return slice(int(start), int(stop))
+
+
+# indices of the values of a sorted axis (wavelengths or times) nearest to
+# each target, for any number of targets at once; ties go to the larger value
+def nearest_indices(axis, targets):
+    axis = numpy.asarray(axis)
+    targets = numpy.asarray(targets)
+    if len(axis) < 2:
+        return numpy.zeros(targets.shape, dtype=numpy.intp)
+    idx = numpy.searchsorted(axis, targets, side='left')
+    idx = numpy.clip(idx, 1, len(axis) - 1)
+    idx -= numpy.abs(targets - axis[idx - 1]) < numpy.abs(targets - axis[idx])
+    return idx
+
+
+# where the background and reference of a run come from: its captured dark
+# and reference spectra, or else its last and first samples. A run with a
+# captured reference but no dark has a zero background, as when it was
+# processed while acquired (see OnlineAbsorbance)
+def correction_sources(reader):
+    if reader.dark() is not None:
+        background = "dark"
+    elif reader.reference() is not None:
+        background = "zero"
+    else:
+        background = "last sample"
+    if reader.reference() is not None:
+        reference = "reference"
+    else:
+        reference = "first sample"
+    return {"background": background, "reference": reference}
+
+
+# loads every spectrum of a run (a RunReader) in one read and returns the
+# absorbance and %T DataFrames (time x wavelength, sorted by time); the
+# background and reference are as given by correction_sources, or the rows
+# bkg_sample and ref_sample of the run if given. Runs processed while they
+# were acquired are read as they are, unless the processing asked for or
+# the corrections are different
+def load_absorbance(reader, SG_window=3, SG_order=2, wav_min=WAV_MIN,
+                    wav_max=WAV_MAX, bkg_sample=None, ref_sample=None):
+    sources = correction_sources(reader)
+    processed = reader.processed_attrs()
+    if (bkg_sample is None and ref_sample is None and processed is not None
+            and processed == dict(sources, SG_window=SG_window,
+                                  SG_order=SG_order, wav_min=wav_min,
+                                  wav_max=wav_max)):
+        absorbance = reader.processed("absorbance")
+        trans = reader.processed("transmission")
+        if len(absorbance) == reader.n_samples:
+            return absorbance_frames(reader, reader.processed_wavelengths(),
+                                     absorbance, trans)
+
+    trim = wavelength_slice(reader.wavelengths, wav_min, wav_max)
+    wavelengths = reader.wavelengths[trim]
+    spectra = numpy.asarray(reader.spectra(trim), dtype=numpy.float64)
+
+    correction = ReferenceSpectra()
+    if bkg_sample is not None:
+        correction.set_dark(wavelengths, spectra[bkg_sample])
+    elif sources["background"] == "dark":
+        correction.set_dark(wavelengths, reader.dark()[trim])
+    elif sources["background"] == "last sample":
+        correction.set_dark(wavelengths, spectra[reader.last()])
+    if ref_sample is not None:
+        ref = spectra[ref_sample]
+    elif sources["reference"] == "reference":
+        ref = reader.reference()[trim]
+    else:
+        ref = spectra[reader.first()]
+    correction.set_reference(wavelengths, ref)
+
+    # transmission change, noise filtered along the wavelength axis
+    correction.transmission(spectra, out=spectra)
+    trans = savgol_smooth(spectra, SG_window, SG_order, axis=1)
+    absorbance = -numpy.log10(trans)
+    return absorbance_frames(reader, wavelengths, absorbance, trans)
+
+
+# absorbance and %T DataFrames indexed by elapsed time, sorted by time
+def absorbance_frames(reader, wavelengths, absorbance, trans):
+    times = reader.elapsed_seconds()
+    order = reader.time_order()
+    spec_df = pd.DataFrame(data=absorbance[order], index=times[order],
+                           columns=wavelengths)
+    trans_df = pd.DataFrame(data=100 * trans[order], index=times[order],
+                            columns=wavelengths)
+    return spec_df, trans_df
@@ -0,0 +1,477 @@
+import time
+from datetime import datetime
+
+import h5py
+import numpy
+
+try:
+    import hdf5plugin                     # registers blosc with HDF5
+except ImportError:
+    hdf5plugin = None
+
+INDEX_DTYPE = numpy.dtype([("sample", numpy.int64),
+                           ("timestamp", numpy.int64)])
+
+# compression of the image stack; level is the codec's own (gzip 0-9, blosc
+# 0-9, lzf has none) and None uses its default
+IMAGE_CODECS = ("none", "gzip", "lzf", "shuffle+gzip", "shuffle+lzf",
+                "blosc")
+
+
+# h5py create_dataset keywords for an image codec
+def image_compression(codec, level=None):
+    if codec == "none":
+        return {}
+    if codec in ("gzip", "shuffle+gzip"):
+        return {"compression": "gzip",
+                "compression_opts": 4 if level is None else level,
+                "shuffle": codec.startswith("shuffle")}
+    if codec in ("lzf", "shuffle+lzf"):
+        return {"compression": "lzf", "shuffle": codec.startswith("shuffle")}
+    if codec == "blosc":
+        if hdf5plugin is None:
+            raise ValueError("the blosc codec needs the hdf5plugin package")
+        return dict(hdf5plugin.Blosc(cname="lz4",
+                                     clevel=5 if level is None else level,
+                                     shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise ValueError("unknown image codec %r, expected one of %s"
+                     % (codec, ", ".join(IMAGE_CODECS)))
+
+
+# keeps one HDF5 file open for a whole run and appends every sample to
+# resizable, chunked datasets:
+#     wavelengths (pixels,)       calibration, written once per run
+#     spectra     (N, pixels)     intensities
+#     images      (N, H, W[, C])  camera frames, one frame per chunk,
+#                                 compressed with image_codec
+#     timestamps  (N,)            time.monotonic_ns() of each sample
+#     lateness_ns (N,)            how late each sample was triggered, for
+#                                 scheduled runs
+#     index       (N,)            sample number and timestamp of each row,
+#                                 with attrs recording whether rows are in
+#                                 sample and time order
+#     dark        (pixels,)       dark and reference spectra, if captured;
+#     reference   (pixels,)       the latest capture of each is kept
+#     processed/                  spectra processed during the run (see
+#                                 OnlineAbsorbance), row n for sample n,
+#                                 with their own trimmed wavelength axis and
+#                                 the processing parameters as group attrs
+# the file attrs anchor the monotonic clock to wall-clock time once per run,
+# and the file is flushed at most every flush_interval_seconds, so a crash
+# loses at most that much data
+class RunWriter:
+    def __init__(self, file_storage, attrs=None, flush_interval_seconds=5,
+                 chunk_rows=64, image_codec="shuffle+gzip", image_level=1):
+        self.file_storage = file_storage
+        self.flush_interval_seconds = flush_interval_seconds
+        self.chunk_rows = chunk_rows      # spectra per chunk
+        self._image_compression = image_compression(image_codec, image_level)
+        self.n_samples = 0
+        self._f = h5py.File(file_storage, 'w')
+        self.attrs = self._f.attrs
+        self.monotonic_anchor_ns = time.monotonic_ns()
+        self.wall_anchor_ns = time.time_ns()
+        timestamp = datetime.fromtimestamp(self.wall_anchor_ns / 1e9)
+        self._f.attrs.create("creation_time",
+                             timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f"))
+        self._f.attrs.create("monotonic_anchor_ns", self.monotonic_anchor_ns)
+        self._f.attrs.create("wall_anchor_ns", self.wall_anchor_ns)
+        for key, value in (attrs or {}).items():
+            self._f.attrs.create(key, value)
+        self._spectra = None
+        self._images = None
+        self._lateness = None
+        self._timestamps = self._f.create_dataset(
+            "timestamps", shape=(0,), maxshape=(None,), dtype=numpy.int64,
+            chunks=(1024,))
+        self._index = self._f.create_dataset(
+            "index", shape=(0,), maxshape=(None,), dtype=INDEX_DTYPE,
+            chunks=(1024,))
+        self._index.attrs["sample_sorted"] = True
+        self._index.attrs["time_sorted"] = True
+        self._last_entry = None           # (sample, timestamp) of last row
+        self._processed = None            # name -> dataset in processed/
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _create_wavelengths(self, wavelengths):
+        if "wavelengths" not in self._f:
+            self._f.create_dataset("wavelengths",
+                                   data=numpy.asarray(wavelengths,
+                                                      dtype=numpy.float64))
+
+    def _create_spectra(self, wavelengths):
+        self._create_wavelengths(wavelengths)
+        shape = (len(wavelengths),)
+        return self._f.create_dataset(
+            "spectra", shape=(0,) + shape, maxshape=(None,) + shape,
+            dtype=numpy.float64, chunks=(self.chunk_rows,) + shape)
+
+    def _create_images(self, image):
+        shape = image.shape
+        return self._f.create_dataset(
+            "images", shape=(0,) + shape, maxshape=(None,) + shape,
+            dtype=image.dtype, chunks=(1,) + shape, **self._image_compression)
+
+    # appends one sample; spectrum is (wavelengths, intensities) as returned
+    # by get_spectrum, image is a single camera frame and timestamp is the
+    # time.monotonic_ns() it was taken at (defaults to now); lateness_ns is
+    # how far that was behind its scheduled time
+    def append(self, spectrum=None, image=None, timestamp=None, sample=None,
+               lateness_ns=None):
+        n = self.n_samples
+        if sample is None:
+            sample = n
+        if spectrum is not None:
+            if self._spectra is None:
+                self._spectra = self._create_spectra(spectrum[0])
+            self._spectra.resize(n + 1, axis=0)
+            self._spectra[n] = spectrum[1]
+        if image is not None:
+            image = numpy.asarray(image)
+            if self._images is None:
+                self._images = self._create_images(image)
+            self._images.resize(n + 1, axis=0)
+            self._images[n] = image
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        self._timestamps.resize(n + 1, axis=0)
+        self._timestamps[n] = timestamp
+        if lateness_ns is not None:
+            if self._lateness is None:
+                self._lateness = self._f.create_dataset(
+                    "lateness_ns", shape=(0,), maxshape=(None,),
+                    dtype=numpy.int64, chunks=(1024,))
+            self._lateness.resize(n + 1, axis=0)
+            self._lateness[n] = lateness_ns
+        self._update_index(n, sample, timestamp)
+        self.n_samples = n + 1
+
+        if time.monotonic() - self._last_flush >= self.flush_interval_seconds:
+            self.flush()
+
+    # stores a dark or reference spectrum, (wavelengths, intensities), with
+    # the time.monotonic_ns() it was captured at and any other attrs (such
+    # as the number of scans averaged); a later capture replaces it
+    def set_dark(self, spectrum, timestamp=None, attrs=None):
+        self._set_correction("dark", spectrum, timestamp, attrs)
+
+    def set_reference(self, spectrum, timestamp=None, attrs=None):
+        self._set_correction("reference", spectrum, timestamp, attrs)
+
+    def _set_correction(self, name, spectrum, timestamp, attrs):
+        self._create_wavelengths(spectrum[0])
+        if name in self._f:
+            del self._f[name]
+        dset = self._f.create_dataset(
+            name, data=numpy.asarray(spectrum[1], dtype=numpy.float64))
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        dset.attrs["timestamp"] = timestamp
+        for key, value in (attrs or {}).items():
+            dset.attrs[key] = value
+        self.flush()
+
+    # sets up the processed/ group for rows over wavelengths; attrs record
+    # how they were made
+    def create_processed(self, wavelengths, attrs=None):
+        group = self._f.create_group("processed")
+        group.create_dataset("wavelengths",
+                             data=numpy.asarray(wavelengths,
+                                                dtype=numpy.float64))
+        for key, value in (attrs or {}).items():
+            group.attrs[key] = value
+        self._processed = {}
+
+    # writes row n of each named processed dataset, e.g.
+    # append_processed(n, absorbance=row, transmission=row)
+    def append_processed(self, n, **rows):
+        group = self._f["processed"]
+        for name, values in rows.items():
+            dset = self._processed.get(name)
+            if dset is None:
+                shape = (len(values),)
+                dset = group.create_dataset(
+                    name, shape=(0,) + shape, maxshape=(None,) + shape,
+                    dtype=numpy.float64,
+                    chunks=(self.chunk_rows,) + shape)
+                self._processed[name] = dset
+            if dset.shape[0] <= n:
+                dset.resize(n + 1, axis=0)
+            dset[n] = values
+
+    def _update_index(self, n, sample, timestamp):
+        self._index.resize(n + 1, axis=0)
+        self._index[n] = (sample, timestamp)
+        if self._last_entry is not None:
+            if sample < self._last_entry[0]:
+                self._index.attrs["sample_sorted"] = False
+            if timestamp < self._last_entry[1]:
+                self._index.attrs["time_sorted"] = False
+        self._last_entry = (sample, timestamp)
+
+    def flush(self):
+        self._f.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._f.id.valid:
+            self._f.close()
+
+
+def parse_timestamp(timestamp):
+    try:
+        return datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f")
+    except ValueError:
+        return datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
+
+
+def datetime_ns(timestamp):
+    return round(timestamp.timestamp() * 1e6) * 1000
+
+
+# read access to a run file written by RunWriter, or to the older layout with
+# one dataset_N group per sample holding spec_N (wavelengths and intensities
+# stacked) and image_N
+class RunReader:
+    def __init__(self, file_storage):
+        self.file_storage = file_storage
+        self._f = h5py.File(file_storage, 'r')
+        self.attrs = self._f.attrs
+        self.legacy = "timestamps" not in self._f
+        if self.legacy:
+            self._index = self._legacy_index()
+        else:
+            index = self._f["index"]
+            self._index = index[()]
+            self._time_zero_ns = int(self.attrs["monotonic_anchor_ns"])
+            self._wall_offset_ns = (int(self.attrs["wall_anchor_ns"]) -
+                                    self._time_zero_ns)
+            self._sample_sorted = bool(index.attrs["sample_sorted"])
+            self._time_sorted = bool(index.attrs["time_sorted"])
+        self.n_samples = len(self._index)
+        self._wavelengths = None
+        self._file_map = None             # whole file, mapped on first use
+
+    # legacy files have no index, so build one from the group names and
+    # timestamp strings, with times as nanoseconds since the epoch; rows are
+    # in sample number order, not HDF5's lexicographic key order (dataset_10
+    # before dataset_2)
+    def _legacy_index(self):
+        numbers = sorted(int(key[8:]) for key in self._f.keys()
+                         if key.startswith("dataset_"))
+        self._groups = ["dataset_%d" % n for n in numbers]
+        index = numpy.zeros(len(numbers), dtype=INDEX_DTYPE)
+        index["sample"] = numbers
+        index["timestamp"] = [
+            datetime_ns(parse_timestamp(self._f[group].attrs["timestamp"]))
+            for group in self._groups]
+        self._time_zero_ns = datetime_ns(
+            parse_timestamp(self.attrs["creation_time"]))
+        self._wall_offset_ns = 0
+        self._sample_sorted = True
+        self._time_sorted = bool(numpy.all(numpy.diff(index["timestamp"]) >= 0))
+        return index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _legacy_dataset(self, n, kind):
+        group = self._f[self._groups[n]]
+        name = "%s_%s" % (kind, self._groups[n][8:])
+        return group[name] if name in group else None
+
+    # sample numbers of each row
+    def sample_numbers(self):
+        return self._index["sample"]
+
+    # row of the sample with the lowest sample number
+    def first(self):
+        if self._sample_sorted:
+            return 0
+        return int(numpy.argmin(self._index["sample"]))
+
+    # row of the sample with the highest sample number
+    def last(self):
+        if self._sample_sorted:
+            return self.n_samples - 1
+        return int(numpy.argmax(self._index["sample"]))
+
+    # rows in order of acquisition time
+    def time_order(self):
+        if self._time_sorted:
+            return numpy.arange(self.n_samples)
+        return numpy.argsort(self._index["timestamp"], kind='stable')
+
+    # wavelength axis shared by every spectrum in the run
+    @property
+    def wavelengths(self):
+        if self._wavelengths is None:
+            if self.legacy:
+                self._wavelengths = self._legacy_dataset(0, "spec")[0]
+            else:
+                self._wavelengths = self._f["wavelengths"][()]
+        return self._wavelengths
+
+    # intensities of sample n
+    def spectrum(self, n):
+        if self.legacy:
+            return self._legacy_dataset(n, "spec")[1]
+        return self._f["spectra"][n]
+
+    # intensities of every sample as one (N, pixels) array; columns selects a
+    # range of pixels so trimmed spectra are read without the rest
+    def spectra(self, columns=slice(None)):
+        if self.legacy:
+            return numpy.array([self._legacy_dataset(n, "spec")[1, columns]
+                                for n in range(self.n_samples)])
+        return self._f["spectra"][:, columns]
+
+    # camera frame of sample n, or None if the run has no images
+    def image(self, n):
+        if not self.has_images():
+            return None
+        return self.images[n]
+
+    def has_images(self):
+        if self.legacy:
+            return self._legacy_dataset(0, "image") is not None
+        return "images" in self._f
+
+    # lazy view of every camera frame in the run; see ImageStack
+    @property
+    def images(self):
+        return ImageStack(self)
+
+    # the bytes of frame n as a read-only array backed by a memory map of
+    # the file, if they are stored uncompressed in one piece; else None
+    def _mapped_image(self, n):
+        if self.legacy:
+            dset = self._legacy_dataset(n, "image")
+            if dset.chunks is not None:
+                return None
+            offset = dset.id.get_offset()
+            shape = dset.shape
+        else:
+            dset = self._f["images"]
+            if dset.id.get_create_plist().get_nfilters():
+                return None
+            info = dset.id.get_chunk_info_by_coord(
+                (n,) + (0,) * (dset.ndim - 1))
+            offset = info.byte_offset
+            shape = dset.shape[1:]
+        if offset is None:
+            return None
+        if self._file_map is None:
+            self._file_map = numpy.memmap(self.file_storage, dtype=numpy.uint8,
+                                          mode='r')
+        size = int(numpy.prod(shape)) * dset.dtype.itemsize
+        return (self._file_map[offset:offset + size]
+                .view(dset.dtype).reshape(shape))
+
+    def _read_image(self, n):
+        frame = self._mapped_image(n)
+        if frame is not None:
+            return frame
+        if self.legacy:
+            return self._legacy_dataset(n, "image")[()]
+        return self._f["images"][n]
+
+    # dark and reference spectra captured during the run, or None
+    def dark(self):
+        return self._correction("dark")
+
+    def reference(self):
+        return self._correction("reference")
+
+    def _correction(self, name):
+        if self.legacy or name not in self._f:
+            return None
+        return self._f[name][()]
+
+    # parameters of the spectra processed during the run, or None if there
+    # are none
+    def processed_attrs(self):
+        if "processed" not in self._f:
+            return None
+        return dict(self._f["processed"].attrs)
+
+    # wavelength axis of the processed spectra
+    def processed_wavelengths(self):
+        return self._f["processed/wavelengths"][()]
+
+    # one processed dataset (N, pixels), e.g. "absorbance", or None
+    def processed(self, name):
+        if "processed" not in self._f or name not in self._f["processed"]:
+            return None
+        return self._f["processed"][name][()]
+
+    # seconds between the creation of the file and each sample
+    def elapsed_seconds(self):
+        return (self._index["timestamp"] - self._time_zero_ns) / 1e9
+
+    # wall-clock time of each sample in nanoseconds since the epoch
+    def wall_times_ns(self):
+        return self._index["timestamp"] + self._wall_offset_ns
+
+    def close(self):
+        self._file_map = None
+        if self._f.id.valid:
+            self._f.close()
+
+
+# the camera frames of a run (or a subset of its rows), read only when they
+# are indexed, so a run of any size opens in constant memory. Uncompressed
+# frames are served straight from a memory map of the file. Index with row
+# numbers (an int, slice or array; a list of frames comes back as one
+# array), or use sample() and at_time() to look frames up, and
+# between() for a lazy view of a time range
+class ImageStack:
+    def __init__(self, reader, rows=None):
+        self.reader = reader
+        if rows is None:
+            rows = numpy.arange(reader.n_samples)
+        self.rows = numpy.asarray(rows)   # rows of the run in this view
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.reader._read_image(int(row))
+
+    def __getitem__(self, key):
+        rows = self.rows[key]
+        if numpy.ndim(rows) == 0:
+            return self.reader._read_image(int(rows))
+        return numpy.stack([self.reader._read_image(int(row))
+                            for row in rows])
+
+    # frame with the given sample number
+    def sample(self, sample):
+        matches = numpy.flatnonzero(
+            self.reader.sample_numbers()[self.rows] == sample)
+        if len(matches) == 0:
+            raise KeyError('no sample %d' % sample)
+        return self[int(matches[0])]
+
+    # frame taken closest to the given elapsed time (seconds)
+    def at_time(self, seconds):
+        times = self.reader.elapsed_seconds()[self.rows]
+        return self[int(numpy.argmin(numpy.abs(times - seconds)))]
+
+    # lazy view of the frames taken between start and stop (seconds, stop
+    # excluded), in time order
+    def between(self, start, stop):
+        times = self.reader.elapsed_seconds()[self.rows]
+        order = numpy.argsort(times, kind='stable')
+        keep = order[(times[order] >= start) & (times[order] < stop)]
+        return ImageStack(self.reader, self.rows[keep])
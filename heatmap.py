@@ -0,0 +1,102 @@
+import numpy
+from matplotlib import colormaps
+from matplotlib.colors import ListedColormap
+from matplotlib.image import NonUniformImage
+
+# time x wavelength maps (absorbance, %T) drawn as one raster image rather
+# than as contours, so the cost depends on the size of the map on screen
+# rather than on the length of the run. Runs with more samples than
+# MAX_ROWS are averaged into MAX_ROWS equal time bins first
+
+MAX_ROWS = 2000
+
+_cmaps = {}
+
+
+# diverging colormap with its midpoint at centre, for a colour scale from
+# vmin to vmax: the lower half of name stretched over vmin..centre and the
+# upper half over centre..vmax (swapped with reverse=True). Made once per
+# (vmin, vmax, centre)
+def shifted_cmap(vmin, vmax, centre, name='RdBu', reverse=False, n_colours=256):
+    key = (vmin, vmax, centre, name, reverse, n_colours)
+    if key not in _cmaps:
+        n_high = int(numpy.floor((vmax - centre) / (vmax - vmin) * n_colours))
+        n_high = min(max(n_high, 0), n_colours)
+        n_low = n_colours - n_high
+        low, mid, high = (1, 0.5, 0) if reverse else (0, 0.5, 1)
+        colours = []
+        if n_low:
+            colours.append(colormaps[name].resampled(n_low)(
+                numpy.linspace(low, mid, n_low)))
+        if n_high:
+            colours.append(colormaps[name].resampled(n_high)(
+                numpy.linspace(mid, high, n_high)))
+        _cmaps[key] = ListedColormap(numpy.vstack(colours),
+                                     name='shifted_cmap')
+    return _cmaps[key]
+
+
+# means of the rows of values (times x columns) in n_bins equal bins of the
+# sorted times, ignoring NaNs; returns the bin centres and the binned values
+# (NaN for empty bins)
+def bin_rows(times, values, n_bins):
+    times = numpy.asarray(times, dtype=numpy.float64)
+    edges = numpy.linspace(times[0], times[-1], n_bins + 1)
+    bounds = numpy.searchsorted(times, edges, side='left')
+    bounds[-1] = len(times)
+    binned = numpy.full((n_bins, values.shape[1]), numpy.nan,
+                        dtype=numpy.float32)
+    for i in range(n_bins):
+        start, stop = bounds[i], bounds[i + 1]
+        if start == stop:
+            continue
+        block = numpy.asarray(values[start:stop], dtype=numpy.float32)
+        finite = numpy.isfinite(block)
+        counts = finite.sum(axis=0)
+        sums = numpy.where(finite, block, 0).sum(axis=0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            binned[i] = sums / counts
+    return (edges[:-1] + edges[1:]) / 2, binned
+
+
+# True if the points of axis are evenly spaced to within a tenth of a step
+def uniform(axis):
+    if len(axis) < 3:
+        return True
+    grid = numpy.linspace(axis[0], axis[-1], len(axis))
+    step = abs(axis[-1] - axis[0]) / (len(axis) - 1)
+    return numpy.max(numpy.abs(axis - grid)) <= 0.1 * step
+
+
+# edges of the cells centred on the points of a sorted axis
+def _extent(axis):
+    if len(axis) < 2:
+        return axis[0] - 0.5, axis[0] + 0.5
+    return (axis[0] - (axis[1] - axis[0]) / 2,
+            axis[-1] + (axis[-1] - axis[-2]) / 2)
+
+
+# draws values (len(y) x len(x); x wavelengths, y times, both sorted) on ax
+# and returns the image, for plt.colorbar. Evenly spaced axes are drawn with
+# imshow; otherwise each cell is drawn at its own position (NonUniformImage)
+def heatmap(ax, x, y, values, vmin, vmax, cmap, max_rows=MAX_ROWS):
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    if len(y) > max_rows:
+        y, values = bin_rows(y, values, max_rows)
+    values = numpy.asarray(values, dtype=numpy.float32)
+    extent = _extent(x) + _extent(y)
+
+    if uniform(x) and uniform(y):
+        image = ax.imshow(values, cmap=cmap, vmin=vmin, vmax=vmax,
+                          origin='lower', aspect='auto',
+                          interpolation='nearest', extent=extent)
+    else:
+        image = NonUniformImage(ax, cmap=cmap, interpolation='nearest',
+                                extent=extent)
+        image.set_data(x, y, values)
+        image.set_clim(vmin, vmax)
+        ax.add_image(image)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    return image
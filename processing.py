@@ -0,0 +1,168 @@
+import threading
+
+import numpy
+
+from correction import ReferenceSpectra
+from display import decimate_mean
+from h5_loader import WAV_MIN, WAV_MAX, wavelength_slice
+from savgol import savgol_smooth
+
+
+# turns each spectrum into trimmed, corrected, Savitzky-Golay filtered
+# transmission and absorbance as it is acquired, the same way load_absorbance
+# does for a whole run, so results are available while the run is going and
+# reopening the run doesn't need to reprocess it. Rows go into preallocated
+# time x wavelength matrices (which double in size if the run is longer than
+# expected) and, given a RunWriter, into the run file's processed/ group
+class OnlineAbsorbance:
+    def __init__(self, references, n_samples, SG_window=3, SG_order=2,
+                 wav_min=WAV_MIN, wav_max=WAV_MAX, writer=None,
+                 time_zero_ns=None):
+        if not references.ready():
+            raise ValueError('capture a reference spectrum first')
+        self.SG_window = SG_window
+        self.SG_order = SG_order
+        self.trim = wavelength_slice(references.wavelengths, wav_min, wav_max)
+        self.wavelengths = references.wavelengths[self.trim]
+        # corrections trimmed once, so each spectrum is corrected in one pass
+        self._correction = ReferenceSpectra()
+        if references.dark is not None:
+            self._correction.set_dark(self.wavelengths,
+                                      references.dark[self.trim])
+        self._correction.set_reference(self.wavelengths,
+                                       references.reference[self.trim])
+        self.writer = writer
+        if time_zero_ns is None and writer is not None:
+            time_zero_ns = writer.monotonic_anchor_ns
+        self.time_zero_ns = time_zero_ns  # first sample's time if None
+        self.n_samples = 0
+        self._allocate(max(1, n_samples))
+
+        if writer is not None:
+            # the corrections used, as correction_sources names them
+            background = "zero" if references.dark is None else "dark"
+            writer.create_processed(self.wavelengths, {
+                "SG_window": SG_window,
+                "SG_order": SG_order,
+                "wav_min": wav_min,
+                "wav_max": wav_max,
+                "background": background,
+                "reference": "reference",
+            })
+
+    def _allocate(self, n_rows):
+        shape = (n_rows, len(self.wavelengths))
+        transmission = numpy.full(shape, numpy.nan)
+        absorbance = numpy.full(shape, numpy.nan)
+        times = numpy.full(n_rows, numpy.nan)
+        if self.n_samples:
+            transmission[:self.n_samples] = self._transmission[:self.n_samples]
+            absorbance[:self.n_samples] = self._absorbance[:self.n_samples]
+            times[:self.n_samples] = self._times[:self.n_samples]
+        self._transmission = transmission
+        self._absorbance = absorbance
+        self._times = times
+
+    # processes one spectrum, (wavelengths, intensities) as returned by
+    # get_spectrum, taken at timestamp (time.monotonic_ns()); returns its
+    # absorbance row
+    def append(self, spectrum, timestamp):
+        n = self.n_samples
+        if n == len(self._times):
+            self._allocate(2 * n)
+        if self.time_zero_ns is None:
+            self.time_zero_ns = timestamp
+
+        row = self._transmission[n]
+        self._correction.transmission(
+            numpy.asarray(spectrum[1], dtype=numpy.float64)[self.trim],
+            out=row)
+        row[:] = savgol_smooth(row, self.SG_window, self.SG_order)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            numpy.log10(row, out=self._absorbance[n])
+        self._absorbance[n] *= -1
+        self._times[n] = (timestamp - self.time_zero_ns) / 1e9
+        self.n_samples = n + 1
+
+        if self.writer is not None:
+            self.writer.append_processed(n, absorbance=self._absorbance[n],
+                                         transmission=self._transmission[n])
+        return self._absorbance[n]
+
+    # views of the rows filled so far: seconds since time zero, absorbance
+    # and transmission (fraction, not %), each time x wavelength
+    def times(self):
+        return self._times[:self.n_samples]
+
+    def absorbance(self):
+        return self._absorbance[:self.n_samples]
+
+    def transmission(self):
+        return self._transmission[:self.n_samples]
+
+
+# the last n_rows absorbance spectra of one spectrometer, each averaged into
+# n_columns wavelength buckets, for a live time x wavelength heat map. Fed
+# by the acquisition thread; viewers ask for the rows they haven't seen yet,
+# so what they fetch per update doesn't grow with the length of the run.
+# Spectra are skipped until there is a reference, and the history starts
+# again (with a new version) if the wavelength axis changes
+class AbsorbanceHistory:
+    def __init__(self, references, n_rows=600, n_columns=500):
+        self.references = references      # ReferenceSpectra
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+        self.time_zero_ns = None          # time of the first row
+        self.wavelengths = None           # bucket centres
+        self._axis = None                 # full wavelength axis
+        self._version = 0
+        self._count = 0                   # rows appended since the reset
+        self._rows = None
+        self._times = numpy.zeros(n_rows)
+        self._lock = threading.Lock()
+
+    # adds the absorbance of spectrum, (wavelengths, intensities), taken at
+    # timestamp (time.monotonic_ns()); returns the row, or None if skipped
+    def append(self, spectrum, timestamp):
+        if not self.references.ready():
+            return None
+        try:
+            absorbance = self.references.absorbance(spectrum[1])
+        except ValueError:
+            return None                   # reference is for another axis
+        row = decimate_mean(absorbance, self.n_columns)
+
+        with self._lock:
+            if (self._axis is None or
+                    not numpy.array_equal(self._axis, spectrum[0])):
+                self._axis = numpy.array(spectrum[0], dtype=numpy.float64)
+                self.wavelengths = decimate_mean(self._axis, self.n_columns)
+                self._rows = numpy.full((self.n_rows, len(row)), numpy.nan,
+                                        dtype=numpy.float32)
+                self._count = 0
+                self._version += 1
+                self.time_zero_ns = timestamp
+            slot = self._count % self.n_rows
+            self._rows[slot] = row
+            self._times[slot] = (timestamp - self.time_zero_ns) / 1e9
+            self._count += 1
+        return row
+
+    # changes whenever the history starts again
+    def version(self):
+        return self._version
+
+    # (count, wavelengths, times, rows) for the rows after the first seen of
+    # them, oldest first, or for every row kept if seen is None; at most
+    # n_rows are returned, and None if there are no new ones. count is what
+    # to pass as seen next time
+    def rows_after(self, seen=None):
+        with self._lock:
+            count = self._count
+            n = count if seen is None else count - seen
+            n = min(n, self.n_rows)
+            if n <= 0:
+                return None
+            slots = numpy.arange(count - n, count) % self.n_rows
+            return (count, self.wavelengths.copy(), self._times[slots],
+                    self._rows[slots])
@@ -0,0 +1,69 @@
+import numpy
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_coeffs
+
+# Savitzky-Golay filtering with the coefficients computed once per
+# (window, order, deriv, delta) and applied to a whole matrix of spectra in
+# one convolution along an axis. Interior points are computed exactly as
+# scipy.signal.savgol_filter does (mode='interp'); the window//2 points at
+# each end come from the same polynomial fits, done as one cached linear map
+
+_kernels = {}
+
+
+# convolution kernel and the matrices giving the filtered values at the
+# start and end from the first and last window points
+def savgol_kernel(window, order, deriv=0, delta=1.0):
+    key = (window, order, deriv, float(delta))
+    if key not in _kernels:
+        kernel = savgol_coeffs(window, order, deriv=deriv, delta=delta,
+                               use='conv')
+        # least-squares polynomial through the window's positions, then its
+        # deriv-th derivative at the positions of the edge points
+        # (centred, which keeps the fit well conditioned)
+        positions = numpy.arange(window) - (window - 1) / 2
+        fit = numpy.linalg.pinv(numpy.vander(positions, order + 1))
+        half = window // 2
+        powers = numpy.arange(order, -1, -1)
+        # d^deriv/dt^deriv t^p = p (p-1) ... (p-deriv+1) t^(p-deriv)
+        scale = numpy.ones(order + 1)
+        for k in range(deriv):
+            scale *= powers - k
+        exponents = numpy.maximum(powers - deriv, 0)
+
+        def values_at(points):
+            return (scale * points[:, None] ** exponents) @ fit / delta ** deriv
+
+        start = values_at(positions[:half])
+        end = values_at(positions[window - half:])
+        _kernels[key] = (kernel, start, end)
+    return _kernels[key]
+
+
+# filters values along axis, like savgol_filter(values, window, order,
+# deriv=deriv, delta=delta, axis=axis)
+def savgol_smooth(values, window, order, deriv=0, delta=1.0, axis=-1):
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if values.shape[axis] < window:
+        raise ValueError('window is longer than the data')
+    kernel, start, end = savgol_kernel(window, order, deriv, delta)
+    filtered = convolve1d(values, kernel, axis=axis, mode='constant')
+
+    half = window // 2
+    if half:
+        data = numpy.moveaxis(values, axis, -1)
+        out = numpy.moveaxis(filtered, axis, -1)
+        out[..., :half] = data[..., :window] @ start.T
+        out[..., -half:] = data[..., -window:] @ end.T
+    return filtered
+
+
+# d/dt of each column of values (time x wavelength), as finite differences
+# between samples (NaN taken as 0) filtered along time; row i is the rate
+# between times[i] and times[i + 1]
+def time_derivative(values, times, window, order):
+    values = numpy.asarray(values, dtype=numpy.float64)
+    times = numpy.asarray(times, dtype=numpy.float64)
+    rates = numpy.diff(values, axis=0) / numpy.diff(times)[:, None]
+    rates[numpy.isnan(rates)] = 0
+    return savgol_smooth(rates, window, order, axis=0)